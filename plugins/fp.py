@@ -2,10 +2,11 @@
 
 """
 FP-adjacent stuff:
-* promise (synchronous Future)
+* promise (synchronous or executor-backed Future), gather
 * dispatch (alternative to OO dispatch)
 * val_dispatch (for state graph traversal)
 * compose (functional composition)
+* memoize (size-bounded lru_cache with disk spill)
 
 and some functools imports
 """
@@ -15,6 +16,19 @@ import sys
 from functools import partial, reduce, lru_cache
 import typing as _t
 from typing import Callable as Fn
+import threading as _threading
+import multiprocessing as _mp
+from concurrent.futures import Future, Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict as _OrderedDict
+from pathlib import Path as _Path
+import time as _time
+import pickle as _pickle
+import hashlib as _hashlib
+import uuid as _uuid
+import shutil as _shutil
+import weakref as _weakref
+from types import MethodType as _MethodType
+from collections import Counter as _Counter
 
 su = sys.startup
 Err = su.Err
@@ -23,8 +37,11 @@ ipyformat = su.ipyformat
 
 __all__ = [
     "promise", 
+    "gather", 
+    "memoize", 
     "ValDispatch", 
     "Dispatch", 
+    "MultiDispatch", 
     "compose", 
     "_none", 
     "partial", 
@@ -32,6 +49,26 @@ __all__ = [
     "lru_cache"
 ]
 
+_POOLS = dict()  # shared executors for `promise.on("thread" | "process")`
+
+def _pool(executor: _t.Union[str, Executor]) -> Executor:
+    if not isinstance(executor, str):
+        return executor
+    pool = _POOLS.get(executor)
+    if pool is None:
+        if executor == "thread":
+            pool = ThreadPoolExecutor()
+        elif executor == "process":
+            try:  # workers unpickle helpers of this path-loaded module, only fork has it
+                ctx = _mp.get_context("fork")
+            except ValueError:
+                raise RuntimeError("promise.on('process') needs the 'fork' start method") from None
+            pool = ProcessPoolExecutor(mp_context=ctx)
+        else:
+            raise KeyError(executor)
+        _POOLS[executor] = pool
+    return pool
+
 class promise:
     """
     decorator that deferres function computation
@@ -39,17 +76,433 @@ class promise:
     @promise
     def my_function...
     ```
+    with an executor, calls are submitted to it and return futures:
+    ```
+    @promise.on("thread") # or "process", or any concurrent.futures.Executor
+    def load(path):...
+    load.add_batch(load_many) # optional, see `add_batch`
+    a, b = gather(load(p1), load(p2))
+    ```
+    process pools get the promise itself, pickled by the name of its function,
+    so it must be defined at module level (decorated or not).
+    lambdas and nested functions raise `pickle.PicklingError` there.
+    `"process"` forks its workers (plugins are loaded by path, so other start methods 
+    cannot import them); a custom process pool needs a fork `mp_context` as well.
     """
-    __slots__ = ("f", )
-    def __init__(self, f: Fn):
+    __slots__ = ("f", "executor", "batch", "batch_size", "linger", "pending", "timer", "lock")
+    def __init__(
+        self, f: Fn, 
+        executor: _t.Union[str, Executor] = None, *, 
+        batch_size: int = 64, 
+        linger: float = 0.05,
+    ):
         self.f = f
+        self.executor = executor
+        self.batch = None
+        self.batch_size = batch_size
+        self.linger = linger
+        self.pending = []
+        self.timer = None
+        self.lock = _threading.Lock()
+
+    @classmethod
+    def on(
+        cls, executor: _t.Union[str, Executor], *, 
+        batch_size: int = 64, 
+        linger: float = 0.05,
+    ) -> Fn[[Fn], "promise"]:
+        """Decorator. Submit calls to `executor`"""
+        def clj(f: Fn) -> promise:
+            return cls(f, executor, batch_size=batch_size, linger=linger)
+        return clj
+
+    def add_batch(self, batch: Fn[[_t.List[_t.Tuple[tuple, dict]]], _t.Sequence]) -> "promise":
+        """
+        `batch([(args, kwargs), ...]) -> [result, ...]` replaces separate calls:
+        pending calls are submitted together once there are `batch_size` of them,
+        when any of their futures is waited on (`gather`, `.result()`)
+        or `linger` seconds after the first of them (so `wait`, `as_completed` finish too)
+        """
+        assert self.executor is not None, "batching requires an executor"
+        self.batch = batch
+        return self
     
-    def __call__(self, *args, **kwargs) -> partial:
-        return partial(self.f, *args, **kwargs)
+    def __call__(self, *args, **kwargs) -> _t.Union[partial, Future]:
+        if self.executor is None:
+            return partial(self.f, *args, **kwargs)
+        if self.batch is None:
+            return _pool(self.executor).submit(_call_promised, self, args, kwargs)
+        fut = _BatchedFuture(self)
+        with self.lock:
+            self.pending.append((args, kwargs, fut))
+            full = len(self.pending) >= self.batch_size
+            if not full and self.timer is None:
+                self.timer = _threading.Timer(self.linger, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+        return fut
+
+    def flush(self) -> None:
+        """submit pending calls as one batch"""
+        with self.lock:
+            calls, self.pending = self.pending, []
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+        calls = [c for c in calls if c[2].set_running_or_notify_cancel()]
+        if not calls:
+            return
+        job = _pool(self.executor).submit(_call_batch, self, [(a, kw) for a, kw, _ in calls])
+        job.add_done_callback(partial(_scatter, [fut for _, _, fut in calls]))
     
     def __repr__(self,) -> str:
         return f"@promise {repr(self.f)}"
 
+    def __reduce__(self):
+        module = getattr(self.f, "__module__", None)
+        qualname = getattr(self.f, "__qualname__", None)
+        obj = None if module is None or qualname is None else _by_name(module, qualname)
+        if obj is not self and obj is not self.f:
+            raise _pickle.PicklingError(
+                f"{self!r}: {module}.{qualname} is not found by name, define it at module level")
+        return _find_promise, (module, qualname, self.batch)
+
+def _by_name(module: str, qualname: str):
+    obj = sys.modules.get(module)
+    for name in qualname.split("."):
+        obj = getattr(obj, name, None)
+    return obj
+
+def _find_promise(module: str, qualname: str, batch: Fn) -> promise:
+    """unpickle a promise in a worker process"""
+    __import__(module)
+    obj = _by_name(module, qualname)
+    p = promise(obj.f if isinstance(obj, promise) else obj)
+    p.batch = batch  # as in the submitting process, even if added after this one imported it
+    return p
+
+def _call_promised(p: promise, args: tuple, kwargs: dict):
+    return p.f(*args, **kwargs)
+
+def _call_batch(p: promise, calls: _t.List[_t.Tuple[tuple, dict]]) -> _t.Sequence:
+    return p.batch(calls)
+
+class _BatchedFuture(Future):
+    """future of a call waiting to be batched. waiting on it submits the batch"""
+    def __init__(self, owner: promise):
+        super().__init__()
+        self.owner = owner
+
+    def result(self, timeout: float = None):
+        self.owner.flush()
+        return super().result(timeout)
+
+    def exception(self, timeout: float = None):
+        self.owner.flush()
+        return super().exception(timeout)
+
+def _scatter(futs: _t.List[Future], job: Future) -> None:
+    """distribute results of a batch `job` to the futures of separate calls"""
+    e = job.exception()
+    if e is None:
+        res = job.result()
+        if len(res) != len(futs):
+            e = ValueError(f"batch returned {len(res)} results for {len(futs)} calls")
+    if e is not None:
+        for fut in futs:
+            fut.set_exception(e)
+        return
+    for fut, r in zip(futs, res):
+        fut.set_result(r)
+
+def gather(*promised: _t.Union[Future, partial], timeout: float = None) -> list:
+    """wait for futures (or run synchronous promises) and return their results in order"""
+    for owner in {p.owner for p in promised if isinstance(p, _BatchedFuture)}:
+        owner.flush()
+    return [p.result(timeout) if isinstance(p, Future) else p() for p in promised]
+
+def _sizeof(x) -> int:
+    """approximate memory footprint: arrays, dataframes and builtin containers"""
+    nbytes = getattr(x, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    memory_usage = getattr(x, "memory_usage", None)
+    if callable(memory_usage):  # pandas
+        m = memory_usage(deep=True)
+        return int(m.sum() if hasattr(m, "sum") else m)
+    size = sys.getsizeof(x)
+    if isinstance(x, (tuple, list, set, frozenset)):
+        size += sum(_sizeof(i) for i in x)
+    elif isinstance(x, dict):
+        size += sum(_sizeof(k) + _sizeof(v) for k, v in x.items())
+    return size
+
+def _freeze(x):
+    """hashable stand-in for an argument. arrays are hashed by their buffer"""
+    if hasattr(x, "__array_interface__") and hasattr(x, "tobytes"):
+        try:
+            buf = memoryview(x).cast("B")
+        except (TypeError, ValueError):  # not contiguous
+            buf = x.tobytes()
+        return (type(x).__name__, x.shape, x.dtype.str, _hashlib.blake2b(buf).digest())
+    if isinstance(x, (list, tuple)):
+        return (type(x).__name__, *map(_freeze, x))
+    if isinstance(x, dict):
+        return ("dict", *sorted((k, _freeze(v)) for k, v in x.items()))
+    if isinstance(x, set):
+        return ("set", frozenset(x))
+    return x
+
+class CacheInfo(_t.NamedTuple):
+    hits: int
+    misses: int
+    disk_hits: int
+    evictions: int
+    spills: int
+    entries: int
+    currbytes: int
+    maxbytes: int
+    diskbytes: int
+
+def _unlink(path: _Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+class memoize:
+    """
+    decorator. like `lru_cache`, but bounded by approximate size of cached values.
+    ```
+    @memoize.bounded(2**30, ttl=3600, spill_dir="~/.cache/tables")
+    def load_table(path: str, columns: np.ndarray) -> pd.DataFrame:...
+    load_table.cache_info()
+    ```
+    * ttl: seconds an entry stays valid (None is forever)
+    * spill_dir: evicted entries are pickled there and loaded back on demand
+      (into a subdirectory of this instance, removed with it or at exit)
+    * maxdisk: bound on spilled bytes (4 * maxbytes by default), oldest files go first;
+      expired files are removed on every spill
+    * numpy array arguments are hashed by their contents, lists and dicts by items
+    * works on methods, the instance is a part of the key (and is kept alive by the cache)
+    """
+    __slots__ = (
+        "f", "maxbytes", "ttl", "spill_dir", "maxdisk", "sizeof", 
+        "entries", "currbytes", "disk", "diskbytes", "lock",
+        "hits", "misses", "disk_hits", "evictions", "spills",
+        "__weakref__",
+    )
+    def __init__(
+        self, f: Fn, 
+        maxbytes: int = 2**30, *, 
+        ttl: float = None, 
+        spill_dir: _t.Union[str, _Path] = None,
+        maxdisk: int = None,
+        sizeof: Fn[[_t.Any], int] = _sizeof,
+    ):
+        self.f = f
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.spill_dir = None
+        if spill_dir is not None:
+            name = "".join(c if c.isalnum() else "_" for c in getattr(f, "__qualname__", "f"))
+            self.spill_dir = _Path(spill_dir).expanduser() / f"{name}-{_uuid.uuid4().hex}"
+            _weakref.finalize(self, _shutil.rmtree, self.spill_dir, ignore_errors=True)
+        self.maxdisk = 4 * maxbytes if maxdisk is None else maxdisk
+        self.sizeof = sizeof
+        self.entries = _OrderedDict()  # key -> (value, size, expires), `expires` is wall time
+        self.currbytes = 0
+        self.disk = _OrderedDict()  # spill path -> (file size, expires), oldest first
+        self.diskbytes = 0
+        self.lock = _threading.Lock()
+        self.hits = self.misses = self.disk_hits = self.evictions = self.spills = 0
+
+    @classmethod
+    def bounded(
+        cls, maxbytes: int, *, 
+        ttl: float = None, 
+        spill_dir: _t.Union[str, _Path] = None,
+        maxdisk: int = None,
+        sizeof: Fn[[_t.Any], int] = _sizeof,
+    ) -> Fn[[Fn], "memoize"]:
+        """Decorator. memoize with options"""
+        def clj(f: Fn) -> memoize:
+            return cls(f, maxbytes, ttl=ttl, spill_dir=spill_dir, maxdisk=maxdisk, sizeof=sizeof)
+        return clj
+
+    def _spill_path(self, key) -> _t.Optional[_Path]:
+        try:
+            b = _pickle.dumps(key)
+        except Exception:
+            return None
+        return self.spill_dir / (_hashlib.blake2b(b, digest_size=16).hexdigest() + ".pkl")
+
+    def _from_disk(self, key) -> tuple:
+        """(found, value, expires)"""
+        path = self._spill_path(key)
+        if path is None:
+            return False, None, None
+        with self.lock:
+            entry = self.disk.pop(path, None)
+            if entry is None:
+                return False, None, None
+            self.diskbytes -= entry[0]
+        try:
+            with open(path, "rb") as f:
+                expires, value = _pickle.load(f)
+        except FileNotFoundError:  # removed by `cache_clear(disk=True)` meanwhile
+            return False, None, None
+        _unlink(path)
+        if expires is not None and expires <= _time.time():
+            return False, None, None
+        return True, value, expires
+
+    def _to_disk(self, key, value, expires) -> None:
+        path = self._spill_path(key)
+        if path is None:
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(path, "wb") as f:
+                _pickle.dump((expires, value), f, protocol=_pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            _unlink(path)
+            return
+        size = path.stat().st_size
+        now = _time.time()
+        with self.lock:
+            self.spills += 1
+            old = self.disk.pop(path, None)
+            if old is not None:
+                self.diskbytes -= old[0]
+            self.disk[path] = (size, expires)
+            self.diskbytes += size
+            dropped = [p for p, (_, exp) in self.disk.items() if exp is not None and exp <= now]
+            for p in dropped:
+                self.diskbytes -= self.disk.pop(p)[0]
+            while self.diskbytes > self.maxdisk and self.disk:
+                p, (sz, _) = self.disk.popitem(last=False)
+                self.diskbytes -= sz
+                dropped.append(p)
+        for p in dropped:
+            _unlink(p)
+
+    def _put(self, key, value, expires: float = None) -> None:
+        """`expires` defaults to ttl from now"""
+        size = self.sizeof(value)
+        if expires is None and self.ttl is not None:
+            expires = _time.time() + self.ttl
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.currbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size, expires)
+            self.currbytes += size
+            while self.currbytes > self.maxbytes and self.entries:
+                k, (v, sz, exp) = self.entries.popitem(last=False)
+                self.currbytes -= sz
+                self.evictions += 1
+                evicted.append((k, v, exp))
+        if self.spill_dir is not None:
+            for k, v, exp in evicted:
+                if exp is None or exp > _time.time():
+                    self._to_disk(k, v, exp)
+
+    def __call__(self, *args, **kwargs):
+        key = (_freeze(args), _freeze(kwargs)) if kwargs else _freeze(args)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[2] is None or entry[2] > _time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self.currbytes -= self.entries.pop(key)[1]
+        if self.spill_dir is not None:
+            found, value, expires = self._from_disk(key)
+            if found:
+                self.disk_hits += 1
+                self._put(key, value, expires)
+                return value
+        self.misses += 1
+        value = self.f(*args, **kwargs)
+        self._put(key, value)
+        return value
+
+    def __get__(self, obj, objtype=None):
+        """bind as a method: the instance becomes part of the key, as with `lru_cache`"""
+        return self if obj is None else _MethodType(self, obj)
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits, self.misses, self.disk_hits, self.evictions, self.spills, 
+            len(self.entries), self.currbytes, self.maxbytes, self.diskbytes)
+
+    def cache_clear(self, *, disk: bool = False) -> None:
+        """drop cached values and reset statistics. `disk` also removes spilled entries (and their directory)"""
+        with self.lock:
+            self.entries.clear()
+            self.currbytes = 0
+            self.hits = self.misses = self.disk_hits = self.evictions = self.spills = 0
+            if disk:
+                self.disk.clear()
+                self.diskbytes = 0
+        if disk and self.spill_dir is not None:
+            _shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def __repr__(self,) -> str:
+        return f"@memoize {repr(self.f)}"
+
+_perf_ns = _time.perf_counter_ns
+
+class CallStats(_t.NamedTuple):
+    """profile of one registry key (or arm). `seconds` include nested calls"""
+    key: _t.Any
+    impl: Fn
+    calls: int
+    seconds: float
+    errors: int
+
+class _Profile:
+    """counters per registry key (or arm position): key -> [calls, ns, errors]"""
+    __slots__ = ("counters", )
+
+    def __init__(self):
+        self.counters = dict()
+
+    def call(self, key, f: Fn, args: tuple, kwargs: dict):
+        c = self.counters.get(key)
+        if c is None:
+            c = self.counters[key] = [0, 0, 0]
+        t0 = _perf_ns()
+        try:
+            return f(*args, **kwargs)
+        except BaseException:
+            c[2] += 1
+            raise
+        finally:
+            c[0] += 1
+            c[1] += _perf_ns() - t0
+
+    def stats(self, items: _t.Iterable[_t.Tuple[_t.Any, Fn]]) -> _t.List[CallStats]:
+        rows = []
+        for key, f in items:
+            calls, ns, errors = self.counters.get(key, (0, 0, 0))
+            rows.append(CallStats(key, f, calls, ns * 1e-9, errors))
+        return rows
+
+def _profile_suffix(profile: _t.Optional[_Profile], key) -> str:
+    if profile is None:
+        return ""
+    calls, ns, errors = profile.counters.get(key, (0, 0, 0))
+    return f" calls={calls} time={ns * 1e-9:.3g}s errors={errors}"
+
+def _missing_state(state, *_, **__):
+    """hole in a dense `ValDispatch` table"""
+    raise KeyError(state)
+
 class ValDispatch:
     """
     Typical in controllers and self-regulating programs. Example:
@@ -68,18 +521,42 @@ class ValDispatch:
     and messy state transition graph --
     10+ possible states, and each transition
     is associated with its own function.
+    For small ranges of non-negative integer (or IntEnum) states,
+    `densify()` keeps a list indexed by state for the `run` driver loop:
+    ```
+    @ValDispatch.new(IDLE)
+    def step(state, ctl) -> int:... # return next state
+    ...
+    step.densify().counting()
+    final = step.run(IDLE, 10**6, ctl)
+    step.counts.most_common(5) # most frequent (state, next_state)
+    ```
     """
-    __slots__ = ("name", "registry", "doc")
+    __slots__ = ("name", "registry", "doc", "table", "max_size", "counts", "profile")
 
     def __init__(self, name: str, doc: str = ""):
         self.name = name
         self.doc = doc
         self.registry = dict()
+        self.table = None  # table[state] == registry[state], holes raise KeyError
+        self.max_size = 0
+        self.counts = None
+        self.profile = None
 
     def register(self, val) -> Fn[[Fn], "ValDispatch"]:
         """Decorator. Adds function to registry."""
         def clj(f: Fn) -> ValDispatch:
+            had, old = val in self.registry, self.registry.get(val)
             self.registry[val] = f
+            if self.table is not None:
+                try:
+                    self.densify(self.max_size)
+                except ValueError:  # the table rejects `val`, so must the registry
+                    if had:
+                        self.registry[val] = old
+                    else:
+                        del self.registry[val]
+                    raise
             return self
         return clj
 
@@ -92,11 +569,94 @@ class ValDispatch:
             return d
         return clj
 
+    def densify(self, max_size: int = 4096) -> "ValDispatch":
+        """
+        build the state-indexed table (kept in sync by `register`).
+        states must be ints (IntEnum members are ints too) in `range(max_size)`
+        """
+        idx = list(self.registry)
+        if not all(isinstance(k, int) for k in idx):
+            raise ValueError("dense dispatch requires int states")
+        if idx and not (0 <= min(idx) and max(idx) < max_size):
+            raise ValueError(f"dense dispatch requires states in range({max_size})")
+        table = [_missing_state] * (max(idx, default=-1) + 1)
+        for i, f in zip(idx, self.registry.values()):
+            table[i] = f
+        self.table, self.max_size = table, max_size
+        return self
+
+    def counting(self, on: bool = True) -> "ValDispatch":
+        """count (state, returned state) transitions in `self.counts`"""
+        self.counts = _Counter() if on else None
+        return self
+
+    def profiling(self, on: bool = True) -> "ValDispatch":
+        """record calls, time and exceptions per state, see `stats`"""
+        self.profile = _Profile() if on else None
+        return self
+
+    def stats(self) -> _t.List[CallStats]:
+        assert self.profile is not None, "profiling is off"
+        return self.profile.stats(self.registry.items())
+
     def dispatch(self, val) -> Fn:
         return self.registry[val]
 
     def __call__(self, *args, **kwargs):
-        return self.dispatch(args[0])(*args, **kwargs)
+        if self.counts is None and self.profile is None:
+            return self.registry[args[0]](*args, **kwargs)
+        f = self.registry[args[0]]
+        res = f(*args, **kwargs) if self.profile is None else self.profile.call(args[0], f, args, kwargs)
+        if self.counts is not None:
+            self.counts[(args[0], res)] += 1
+        return res
+
+    def run(self, state, steps: int, *args, **kwargs):
+        """
+        `state = self(state, *args, **kwargs)` `steps` times.
+        a transition may return None to stop. returns the final (last non-None) state
+        """
+        table = self.table
+        if self.counts is not None or self.profile is not None:
+            for _ in range(steps):
+                nxt = self(state, *args, **kwargs)
+                if nxt is None:
+                    break
+                state = nxt
+            return state
+        if table is None:
+            registry = self.registry
+            for _ in range(steps):
+                nxt = registry[state](state, *args, **kwargs)
+                if nxt is None:
+                    break
+                state = nxt
+            return state
+        try:  # loops are specialized by arity, argument unpacking costs as much as lookup
+            if not args and not kwargs:
+                for _ in range(steps):
+                    nxt = (table[state] if state >= 0 else _missing_state)(state)
+                    if nxt is None:
+                        break
+                    state = nxt
+            elif len(args) == 1 and not kwargs:
+                a, = args
+                for _ in range(steps):
+                    nxt = (table[state] if state >= 0 else _missing_state)(state, a)
+                    if nxt is None:
+                        break
+                    state = nxt
+            else:
+                for _ in range(steps):
+                    nxt = (table[state] if state >= 0 else _missing_state)(state, *args, **kwargs)
+                    if nxt is None:
+                        break
+                    state = nxt
+        except (IndexError, TypeError):  # raised by a transition or by the lookup of `state`
+            if isinstance(state, int) and 0 <= state < len(table):
+                raise
+            raise KeyError(state) from None
+        return state
 
     def __repr__(self,) -> str:
         return f"<ValDispatch {self.name} at {hex(id(self))}>"
@@ -106,7 +666,8 @@ class ValDispatch:
             return ipyformat.data
         return (
             f"ValDispatch {self.name}\nregistry:\n\t" +
-            "\n\t".join(f"{k}={ipyformat(v)}" for k, v in self.registry.items())
+            "\n\t".join(f"{k}={ipyformat(v)}{_profile_suffix(self.profile, k)}" 
+                for k, v in self.registry.items())
         )
 class Dispatch:
     """
@@ -123,18 +684,46 @@ class Dispatch:
     ```
     Especially useful when interface types are not
     known in advance or will be extended by plugins/other users.
+    Subclasses use the implementation of the closest
+    registered base (by MRO), resolved once per type and cached.
+    For collections of mixed objects use `map`, it calls batch
+    implementations (`register_batch`) once per type:
+    ```
+    @draw.register_batch(Circle)
+    def draw(circs: List[Circle]) -> List[SVG]:...
+    svgs = draw.map(shapes)
+    ```
     """
-    __slots__ = ("name", "registry", "doc")
+    __slots__ = ("name", "registry", "doc", "cache", "bases", "profile", "batch_registry", "batch_cache")
 
     def __init__(self, name: str, doc: str = ""):
         self.name = name
         self.doc = doc
         self.registry = dict()
+        self.cache = dict()
+        self.bases = dict()  # type -> registry key it resolved to, alongside `cache`
+        self.profile = None
+        self.batch_registry = dict()
+        self.batch_cache = dict()
 
     def register(self, t: type) -> Fn[[Fn], "Dispatch"]:
         """Decorator. Adds function to registry."""
         def clj(f: Fn) -> Dispatch:
             self.registry[t] = f
+            self.cache.clear()
+            self.bases.clear()
+            self.batch_cache.clear()
+            return self
+        return clj
+
+    def register_batch(self, t: type) -> Fn[[Fn], "Dispatch"]:
+        """
+        Decorator. Adds `f(xs: List[t], *args, **kwargs) -> List[result]` 
+        to batch registry (used by `map`)
+        """
+        def clj(f: Fn) -> Dispatch:
+            self.batch_registry[t] = f
+            self.batch_cache.clear()
             return self
         return clj
 
@@ -147,11 +736,83 @@ class Dispatch:
             return d
         return clj
 
+    def profiling(self, on: bool = True) -> "Dispatch":
+        """record calls, time and exceptions per registered type, see `stats`"""
+        self.profile = _Profile() if on else None
+        return self
+
+    def stats(self) -> _t.List[CallStats]:
+        assert self.profile is not None, "profiling is off"
+        return self.profile.stats(self.registry.items())
+
     def dispatch(self, t: type) -> Fn:
-        return self.registry[t]
+        try:
+            return self.cache[t]
+        except KeyError:
+            pass
+        for base in t.__mro__:
+            if base in self.registry:
+                self.bases[t] = base
+                f = self.cache[t] = self.registry[base]
+                return f
+        raise KeyError(t)
+
+    def dispatch_batch(self, t: type) -> _t.Optional[Fn]:
+        """
+        batch implementation for `t` or None. a batch implementation is used
+        unless a per-element one is registered for a closer base
+        """
+        try:
+            return self.batch_cache[t]
+        except KeyError:
+            pass
+        f = None
+        for base in t.__mro__:
+            if base in self.batch_registry:
+                f = self.batch_registry[base]
+                break
+            if base in self.registry:
+                break
+        self.batch_cache[t] = f
+        return f
 
     def __call__(self, *args, **kwargs):
-        return self.dispatch(type(args[0]))(*args, **kwargs)
+        t = type(args[0])
+        try:
+            f = self.cache[t]
+        except KeyError:
+            f = self.dispatch(t)
+        if self.profile is None:
+            return f(*args, **kwargs)
+        return self.profile.call(self.bases[t], f, args, kwargs)
+
+    def map(self, xs: _t.Iterable, *args, **kwargs) -> list:
+        """
+        `[self(x, *args, **kwargs) for x in xs]`, but elements are grouped by type
+        and batch implementations are called once per group. order is preserved
+        """
+        xs = xs if isinstance(xs, (list, tuple)) else list(xs)
+        groups = dict()  # type -> indices
+        for i, t in enumerate(map(type, xs)):
+            idx = groups.get(t)
+            if idx is None:
+                groups[t] = [i]
+            else:
+                idx.append(i)
+        out = [None] * len(xs)
+        for t, idx in groups.items():
+            items = [xs[i] for i in idx]
+            fb = self.dispatch_batch(t)
+            if fb is not None:
+                res = fb(items, *args, **kwargs)
+                if len(res) != len(items):
+                    raise ValueError(f"batch implementation for {t} returned {len(res)} results for {len(items)} items")
+            else:
+                f = self.dispatch(t)
+                res = [f(x, *args, **kwargs) for x in items]
+            for i, r in zip(idx, res):
+                out[i] = r
+        return out
 
     def __repr__(self,) -> str:
         return f"<Dispatch {self.name} at {hex(id(self))}>"
@@ -161,6 +822,96 @@ class Dispatch:
             return ipyformat.data
         return (
             f"Dispatch {self.name}\nregistry:\n\t" +
+            "\n\t".join(f"{k}={ipyformat(v)}{_profile_suffix(self.profile, k)}" 
+                for k, v in self.registry.items())
+        )
+
+
+def _mro_rank(t: type, s: type) -> int:
+    """position of `s` in `t.__mro__`; virtual bases go after all real ones"""
+    try:
+        return t.__mro__.index(s)
+    except ValueError:
+        return len(t.__mro__)
+
+
+class MultiDispatch:
+    """
+    Dispatch on the types of the first `k` arguments. Example
+    ```
+    @MultiDispatch.new(Gaussian, Gaussian)
+    def add(a: Gaussian, b: Gaussian) -> Gaussian:...
+    @add.register(Gaussian, LSpline)
+    def add(a: Gaussian, b: LSpline) -> Op:...
+    ```
+    Registered signatures match subclasses as well, including virtual ones
+    (`issubclass`, e.g. `numbers.Number` for `float`).
+    Among matching signatures, the one closest (by MRO) in the first argument wins,
+    then in the second one, etc.; a virtual base ranks after every real MRO entry.
+    Remaining ties go to the earliest registration.
+    Resolution is cached per tuple of argument types.
+    """
+    __slots__ = ("name", "registry", "doc", "k", "cache")
+
+    def __init__(self, name: str, k: int, doc: str = ""):
+        self.name = name
+        self.doc = doc
+        self.k = k
+        self.registry = dict()
+        self.cache = dict()
+
+    def register(self, *ts: type) -> Fn[[Fn], "MultiDispatch"]:
+        """Decorator. Adds function to registry."""
+        assert len(ts) == self.k, f"expected {self.k} types, got {len(ts)}"
+        def clj(f: Fn) -> MultiDispatch:
+            self.registry[ts] = f
+            self.cache.clear()
+            return self
+        return clj
+
+    @classmethod
+    def new(cls, *ts: type, doc: str = None) -> Fn[[Fn], "MultiDispatch"]:
+        """Decorator. Internalises __name__ and __doc__ of a function"""
+        def clj(f: Fn) -> MultiDispatch:
+            d = cls(f.__name__, len(ts), doc or f.__doc__)
+            d.registry[ts] = f
+            return d
+        return clj
+
+    def dispatch(self, ts: _t.Tuple[type, ...]) -> Fn:
+        try:
+            return self.cache[ts]
+        except KeyError:
+            pass
+        if len(ts) != self.k:  # never cached, so short calls always end up here
+            raise TypeError(f"{self.name} dispatches on {self.k} positional arguments, got {len(ts)}")
+        best = None
+        for order, (sig, f) in enumerate(self.registry.items()):
+            if all(issubclass(t, s) for t, s in zip(ts, sig)):
+                rank = (tuple(_mro_rank(t, s) for t, s in zip(ts, sig)), order)
+                if best is None or rank < best[0]:
+                    best = (rank, f)
+        if best is None:
+            raise KeyError(ts)
+        f = self.cache[ts] = best[1]
+        return f
+
+    def __call__(self, *args, **kwargs):
+        ts = tuple(map(type, args[:self.k]))
+        try:
+            f = self.cache[ts]
+        except KeyError:
+            f = self.dispatch(ts)
+        return f(*args, **kwargs)
+
+    def __repr__(self,) -> str:
+        return f"<MultiDispatch {self.name} at {hex(id(self))}>"
+
+    def repr_detailed(self) -> str:
+        if is_err(ipyformat):
+            return ipyformat.data
+        return (
+            f"MultiDispatch {self.name}\nregistry:\n\t" +
             "\n\t".join(f"{k}={ipyformat(v)}" for k, v in self.registry.items())
         )
 
@@ -174,42 +925,157 @@ class Classifier:
     """
     works as dynamically extendable match statement
     apply functions from a list until they return a non-None result
+    options:
+    * key: cheap function of the first argument (e.g. `type`, `attrgetter("tag")`).
+    arms added with `guard` keys are only tried when the key is among them
+    * counting: keep per-arm `hits` and `misses`
+    * adapt_every: every that many calls, reorder arms by hit rate,
+    never moving an arm ahead of one with higher `priority`.
+    reordering assumes that arms of equal priority do not overlap
     """
-    __slots__ = ("name", "doc", "arms", "else_")
+    __slots__ = (
+        "name", "doc", "arms", "else_", 
+        "guards", "priorities", "key", "index",
+        "hits", "misses", "adapt_every", "calls", "profile",
+    )
 
-    def __init__(self, name: str, doc: str = ""):
+    def __init__(
+        self, name: str, doc: str = "", *, 
+        key: Fn = None, 
+        counting: bool = False, 
+        adapt_every: int = 0,
+    ):
         self.name = name
         self.doc = doc
         self.arms = []
         self.else_ = _none
+        self.guards = []
+        self.priorities = []
+        self.key = key
+        self.index = dict()  # key -> indices of arms to try
+        counting = counting or adapt_every > 0
+        self.hits = [] if counting else None
+        self.misses = [] if counting else None
+        self.adapt_every = adapt_every
+        self.calls = 0
+        self.profile = None
 
     def add_else(self, else_: Fn) -> "Classifier":
         self.else_ = else_
         return self
 
-    def add_arm(self, *, insert_at: int = None) -> Fn[[Fn], "Classifier"]:
-        """Decorator. Add arm at the last position or at another specified position"""
+    def add_arm(
+        self, *, 
+        insert_at: int = None, 
+        guard = None, 
+        priority: int = 0,
+    ) -> Fn[[Fn], "Classifier"]:
+        """
+        Decorator. Add arm at the last position or at another specified position.
+        `guard` is a key or a collection of keys the arm can match
+        """
+        if guard is not None and not isinstance(guard, (tuple, list, set, frozenset)):
+            guard = (guard, )
+        guard = None if guard is None else frozenset(guard)
         def clj(arm: Fn) -> "Classifier":
-            (self.arms.append(arm) if insert_at is None
-             else self.arms.insert(insert_at, arm))
+            i = len(self.arms) if insert_at is None else insert_at
+            order = list(range(len(self.arms)))
+            order.insert(i, None)
+            self._moved(order)
+            self.arms.insert(i, arm)
+            self.guards.insert(i, guard)
+            self.priorities.insert(i, priority)
+            if self.hits is not None:
+                self.hits.insert(i, 0)
+                self.misses.insert(i, 0)
+            self.index.clear()
             return self
         return clj
 
     @classmethod
-    def new(cls, doc: str = None) -> Fn[[Fn], "Classifier"]:
+    def new(cls, doc: str = None, **options) -> Fn[[Fn], "Classifier"]:
         """Decorator. Internalises __name__ and __doc__ of a function"""
         def clj(f: Fn) -> Classifier:
-            d = cls(f.__name__, doc or f.__doc__)
-            d.arms.append(f)
-            return d
+            d = cls(f.__name__, doc or f.__doc__, **options)
+            return d.add_arm()(f)
         return clj
 
+    def profiling(self, on: bool = True) -> "Classifier":
+        """record calls, time and exceptions per arm, see `stats`"""
+        self.profile = _Profile() if on else None
+        return self
+
+    def stats(self) -> _t.List[CallStats]:
+        """keys are arm positions and "else" """
+        assert self.profile is not None, "profiling is off"
+        return self.profile.stats([*enumerate(self.arms), ("else", self.else_)])
+
+    def arm_indices(self, key) -> _t.Tuple[int, ...]:
+        """indices of arms to try for `key`"""
+        try:
+            return self.index[key]
+        except KeyError:
+            pass
+        idx = self.index[key] = tuple(
+            i for i, g in enumerate(self.guards) if g is None or key in g)
+        return idx
+
+    def reorder(self) -> "Classifier":
+        """sort arms by priority, then by hit rate (stable)"""
+        assert self.hits is not None, "reordering requires counting"
+        hits, misses = self.hits, self.misses
+        rate = lambda i: hits[i] / (hits[i] + misses[i]) if hits[i] else 0.
+        order = sorted(range(len(self.arms)), key=lambda i: (-self.priorities[i], -rate(i)))
+        for name in ("arms", "guards", "priorities", "hits", "misses"):
+            xs = getattr(self, name)
+            xs[:] = [xs[i] for i in order]
+        self._moved(order)
+        self.index.clear()
+        return self
+
+    def _moved(self, order: _t.List[_t.Optional[int]]) -> None:
+        """arm `j` used to be arm `order[j]` (None for a new one), its profile follows it"""
+        if self.profile is None:
+            return
+        c = self.profile.counters
+        moved = {j: c[i] for j, i in enumerate(order) if i in c}
+        if "else" in c:
+            moved["else"] = c["else"]
+        self.profile.counters = moved
+
     def __call__(self, *args, **kwargs):
-        for arm in self.arms:
-            res = arm(*args, **kwargs)
+        if self.key is None and self.hits is None and self.profile is None:
+            for arm in self.arms:
+                res = arm(*args, **kwargs)
+                if res is not None:
+                    return res
+            return self.else_(*args, **kwargs)
+        return self._call_tracked(args, kwargs)
+
+    def _call_tracked(self, args: tuple, kwargs: dict):
+        arms, hits, misses, prof = self.arms, self.hits, self.misses, self.profile
+        idx = range(len(arms)) if self.key is None else self.arm_indices(self.key(args[0]))
+        res = None
+        if hits is None:
+            for i in idx:
+                res = arms[i](*args, **kwargs) if prof is None else prof.call(i, arms[i], args, kwargs)
+                if res is not None:
+                    return res
+            return self.else_(*args, **kwargs) if prof is None else prof.call("else", self.else_, args, kwargs)
+        for i in idx:
+            res = arms[i](*args, **kwargs) if prof is None else prof.call(i, arms[i], args, kwargs)
             if res is not None:
-                return res
-        return self.else_(*args, **kwargs)
+                hits[i] += 1
+                break
+            misses[i] += 1
+        if self.adapt_every:
+            self.calls += 1
+            if self.calls >= self.adapt_every:
+                self.calls = 0
+                self.reorder()
+        if res is not None:
+            return res
+        return self.else_(*args, **kwargs) if prof is None else prof.call("else", self.else_, args, kwargs)
 
     def __repr__(self,) -> str:
         return f"<Classifier {self.name} at {hex(id(self))}>"
@@ -217,23 +1083,57 @@ class Classifier:
     def repr_detailed(self) -> str:
         if is_err(ipyformat):
             return ipyformat.data
+        counts = ((lambda i: "") if self.hits is None else
+            (lambda i: f" hits={self.hits[i]} misses={self.misses[i]}"))
         return (
             f"Classifier {self.name}\narms:\n\t" +
-            "\n\t".join(ipyformat(arm) for arm in self.arms) +
-            f"\nelse: {ipyformat(self.else_)}"
+            "\n\t".join(ipyformat(arm) + counts(i) + _profile_suffix(self.profile, i)
+                for i, arm in enumerate(self.arms)) +
+            f"\nelse: {ipyformat(self.else_)}{_profile_suffix(self.profile, 'else')}"
         )
 
+@lru_cache(maxsize=None)
+def _compile_chain(n: int) -> Fn:
+    """generate `make(f0, .., fn) -> (chain, chain_map)` for chains of `n` functions"""
+    fs = [f"f{i}" for i in range(n)]
+    calls = lambda indent: "".join(f"{indent}x = {f}(x)\n" for f in fs)
+    src = (
+        f"def make({', '.join(fs)}):\n"
+        f"    def chain(x):\n{calls(' ' * 8)}        return x\n"
+        f"    def chain_map(xs):\n"
+        f"        out = []\n"
+        f"        push = out.append\n"
+        f"        for x in xs:\n{calls(' ' * 12)}            push(x)\n"
+        f"        return out\n"
+        f"    return chain, chain_map\n"
+    )
+    ns = dict()
+    exec(compile(src, f"<compose of {n}>", "exec"), ns)
+    return ns["make"]
+
 class compose:
-    """function composition"""
-    __slots__ = ("fs", )
+    """function composition. nested compositions are flattened"""
+    __slots__ = ("fs", "_compiled")
     def __init__(self, *fs: Fn):
-        self.fs = fs
+        self.fs = tuple(g for f in fs for g in (f.fs if type(f) is compose else (f, )))
+        self._compiled = None
     
     def __call__(self, x):
         for f in self.fs:
             x = f(x)
         return x
 
+    def compile(self) -> Fn:
+        """straight-line function that calls every stage directly (generated once)"""
+        if self._compiled is None:
+            self._compiled = _compile_chain(len(self.fs))(*self.fs)
+        return self._compiled[0]
+
+    def map(self, xs: _t.Iterable) -> list:
+        """`[self(x) for x in xs]` in a single generated loop"""
+        self.compile()
+        return self._compiled[1](xs)
+
     def __gt__(self, f: Fn) -> "compose":
         """a copy with another function at the rear"""
         return compose(*self.fs, f)
@@ -247,6 +1147,3 @@ class compose:
             "composition(" + 
             " |> ".join(repr(f) for f in self.fs) + 
             ")")
-
-            
-    
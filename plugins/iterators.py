@@ -1,6 +1,16 @@
 import typing as _t
 from typing import Callable as _F
 from itertools import *
+from array import array as _array
+import struct as _struct
+import pickle as _pickle
+import asyncio as _asyncio
+from inspect import isawaitable as _isawaitable
+from collections import deque as _deque
+import threading as _threading
+import multiprocessing as _mp
+import queue as _queue
+from time import perf_counter_ns as _perf_ns
 
 _T = _t.TypeVar("_T")
 _T1 = _t.TypeVar("_T1")
@@ -63,6 +73,58 @@ def zip_w_next(itr: _t.Iterable[_T]) -> _t.Iterator[_t.Tuple[_T, _T]]:
         yield (prev, i)
         prev = i
 
+
+def sliding(
+    itr: _t.Iterable[_T], 
+    n: int, 
+    step: int = 1, *,
+    dtype = None,
+) -> _t.Iterator[_t.Sequence[_T]]:
+    """
+    windows of `n` consecutive items, advancing by `step`; incomplete windows are dropped.
+    by default windows are tuples (from a deque). with numpy `dtype` items 
+    (scalars or equally-shaped arrays) go into a preallocated ring buffer,
+    and windows are zero-copy views that are valid until the next window is requested:
+    ```
+    means = [w.mean() for w in sliding(sensor_stream(), 1000, 100, dtype=float)]
+    ```
+    """
+    assert n > 0 and step > 0, "n and step must be positive"
+    xs = iter(itr)
+    first = list(islice(xs, n))
+    if len(first) < n:
+        return
+    if dtype is None:
+        window = _deque(first, maxlen=n)
+        push = window.append
+        yield tuple(window)
+        while True:
+            k = 0
+            for x in islice(xs, step):
+                push(x)
+                k += 1
+            if k < step:
+                return
+            yield tuple(window)
+    import numpy as np
+    first = np.asarray(first, dtype=dtype)
+    # every item is written twice, so any window is a contiguous slice
+    ring = np.empty((2 * n, *first.shape[1:]), dtype=first.dtype)
+    ring[:n] = first
+    ring[n:] = first
+    i = n - 1  # position of the newest item
+    yield ring[n:]
+    while True:
+        k = 0
+        for x in islice(xs, step):
+            i = i + 1 if i + 1 < n else 0
+            ring[i] = x
+            ring[i + n] = x
+            k += 1
+        if k < step:
+            return
+        yield ring[i + 1:i + 1 + n]
+
        
 def infinity(start = 0, step = 1):
     while True:
@@ -167,6 +229,843 @@ def unflatten(
             stack[-1].append(leaf_cons(x))
     assert len(stack) == 1, "number of braces does not match"
     return root_hook
-            
-   
 
+
+class Ragged(_t.NamedTuple):
+    """
+    flattened recursive object as a pair of compact arrays (CSR-style).
+    `values` are the leaves in `flatten` order; every inner node
+    (the root included, in pre-order) is described by
+    `depth` (brace level), `start:stop` (its leaves in `values`)
+    and `end` (pre-order index past the last node of its subtree).
+    """
+    values: _t.Sequence
+    depth: _t.Sequence[int]
+    start: _t.Sequence[int]
+    stop: _t.Sequence[int]
+    end: _t.Sequence[int]
+
+    def n_nodes(self) -> int:
+        return len(self.depth)
+
+    def leaves(self, node: int = 0) -> _t.Sequence:
+        """all leaves of the `node` subtree (a slice of `values`)"""
+        return self.values[self.start[node]:self.stop[node]]
+
+    def subtree(self, node: int) -> "Ragged":
+        """`node` subtree as a standalone `Ragged` (slices and shifts, no recursion)"""
+        b, e = node, self.end[node]
+        lb, d = self.start[node], self.depth[node]
+        shift = lambda xs, by: _array("q", (x - by for x in xs))
+        return Ragged(
+            self.values[lb:self.stop[node]],
+            shift(self.depth[b:e], d),
+            shift(self.start[b:e], lb),
+            shift(self.stop[b:e], lb),
+            shift(self.end[b:e], b),
+        )
+
+    def braces(self) -> _t.Iterator[_t.Union[_T, _Brace]]:
+        """the same stream as `flatten(tree, braces=True)`"""
+        values, depth, start, stop, end = self
+        stack = []  # node indices
+        cur = 0
+        for i in range(len(depth) + 1):
+            while stack and (i == len(depth) or end[stack[-1]] <= i):
+                node = stack.pop()
+                yield from values[cur:stop[node]]
+                cur = stop[node]
+                yield _Brace(depth[node], False)
+            if i == len(depth):
+                break
+            yield from values[cur:start[i]]
+            cur = start[i]
+            yield _Brace(depth[i], True)
+            stack.append(i)
+
+
+def to_ragged(
+    xs: _t.Iterable[_t.Union[_T, "recursive"]], *,
+    recur_when: _F[[_t.Union[_T, "recursive"]], bool] = is_iterable,
+    as_iterator = as_iterator,
+    typecode: str = None,
+) -> Ragged:
+    """
+    flatten `xs` into a `Ragged` (like `flatten`, but no `_Brace` per node).
+    `typecode` (see `array` module) packs leaves into a typed array,
+    so `np.frombuffer(r.values, ...)` can view them without copying.
+    ```
+    xs = [1, 2, [3, 4, 5], 6, [7, 8, [9, 10, [11, ]]], 12]
+    r = to_ragged(xs, typecode="q")
+    assert from_ragged(r) == xs
+    assert from_ragged(r.subtree(2)) == [7, 8, [9, 10, [11, ]]]
+    ```
+    """
+    values = [] if typecode is None else _array(typecode)
+    push = values.append
+    depth, start, stop, end = (_array("q", [0]) for _ in range(4))
+    stack = [(as_iterator(xs), 0), ]
+    while stack:
+        xs, node = stack[-1]
+        for x in xs:
+            if recur_when(x):
+                i = len(depth)
+                depth.append(len(stack))
+                start.append(len(values))
+                stop.append(0)
+                end.append(0)
+                stack.append((as_iterator(x), i))
+                break
+            else:
+                push(x)
+        else: # loop finished with no exceptions or breaks
+            stack.pop()
+            stop[node] = len(values)
+            end[node] = len(depth)
+    return Ragged(values, depth, start, stop, end)
+
+
+def from_ragged(
+    r: Ragged,
+    tree_cons: _F[[_t.List[_t.Union[_T, _T1]]], _T1] = list,
+    leaf_cons: _F[[_T], _T1] = _identity,
+) -> _T1:
+    """
+    inverse of `to_ragged`, see `unflatten` for `tree_cons` and `leaf_cons`.
+    leaves are moved by slices, so python-level work is per node, not per leaf.
+    """
+    values, depth, start, stop, end = r
+    leaves = ((lambda b, e: values[b:e]) if leaf_cons is _identity
+        else (lambda b, e: map(leaf_cons, values[b:e])))
+    n = len(depth)
+    root_hook = []
+    stack = [(root_hook, -1), ]  # (children, node)
+    cur = 0
+    for i in range(n + 1):
+        while len(stack) > 1 and (i == n or end[stack[-1][1]] <= i):
+            children, node = stack.pop()
+            children.extend(leaves(cur, stop[node]))
+            cur = stop[node]
+            stack[-1][0].append(tree_cons(children))
+        if i == n:
+            break
+        stack[-1][0].extend(leaves(cur, start[i]))
+        cur = start[i]
+        stack.append(([], i))
+    return root_hook[0]
+
+
+# brace stream binary format: magic, then records `tag: u8` + payload.
+# braces carry their level as u32, leaves of common types are packed
+# natively, anything else is pickled. all numbers are little-endian.
+_BRACES_MAGIC = b"BRC1"
+_TAG_LEFT, _TAG_RIGHT = 1, 2
+_TAG_NONE, _TAG_TRUE, _TAG_FALSE = 3, 4, 5
+_TAG_INT, _TAG_FLOAT, _TAG_STR, _TAG_BYTES, _TAG_PICKLE = 6, 7, 8, 9, 10
+_u8, _u32 = _struct.Struct("<B"), _struct.Struct("<I")
+_i64, _f64 = _struct.Struct("<q"), _struct.Struct("<d")
+_u8u32, _u8i64, _u8f64 = _struct.Struct("<BI"), _struct.Struct("<Bq"), _struct.Struct("<Bd")
+
+
+def _encode_leaf(x) -> bytes:
+    t = type(x)
+    if t is int and -2**63 <= x < 2**63:
+        return _u8i64.pack(_TAG_INT, x)
+    if t is float:
+        return _u8f64.pack(_TAG_FLOAT, x)
+    if t is str:
+        b = x.encode("utf-8")
+        return _u8u32.pack(_TAG_STR, len(b)) + b
+    if t is bytes:
+        return _u8u32.pack(_TAG_BYTES, len(x)) + x
+    if x is None:
+        return _u8.pack(_TAG_NONE)
+    if t is bool:
+        return _u8.pack(_TAG_TRUE if x else _TAG_FALSE)
+    b = _pickle.dumps(x, protocol=_pickle.HIGHEST_PROTOCOL)
+    return _u8u32.pack(_TAG_PICKLE, len(b)) + b
+
+
+def dump_braces(
+    xs: _t.Iterable[_t.Union[_T, _Brace]],
+    f: _t.BinaryIO,
+) -> int:
+    """
+    incrementally write a `flatten(tree, braces=True)` stream
+    to a binary file `f`. returns the number of records written.
+    ```
+    with open("tree.brc", "wb") as f:
+        dump_braces(flatten(xs, braces=True), f)
+    ```
+    """
+    write = f.write
+    write(_BRACES_MAGIC)
+    n = 0
+    for x in xs:
+        if type(x) == _Brace:
+            write(_u8u32.pack(_TAG_LEFT if x.left else _TAG_RIGHT, x.level))
+        else:
+            write(_encode_leaf(x))
+        n += 1
+    return n
+
+
+def load_braces(f: _t.BinaryIO) -> _t.Iterator[_t.Union[_T, _Brace]]:
+    """
+    lazily read the stream written by `dump_braces`.
+    ```
+    with open("tree.brc", "rb") as f:
+        xs = unflatten(load_braces(f))[0]
+    ```
+    """
+    read = f.read
+    if read(len(_BRACES_MAGIC)) != _BRACES_MAGIC:
+        raise ValueError("not a brace stream")
+    def exact(n: int) -> bytes:
+        b = read(n)
+        if len(b) != n:
+            raise EOFError("brace stream is truncated")
+        return b
+    while True:
+        tag = read(1)
+        if not tag:
+            return
+        tag = tag[0]
+        if tag == _TAG_LEFT or tag == _TAG_RIGHT:
+            yield _Brace(_u32.unpack(exact(4))[0], tag == _TAG_LEFT)
+        elif tag == _TAG_INT:
+            yield _i64.unpack(exact(8))[0]
+        elif tag == _TAG_FLOAT:
+            yield _f64.unpack(exact(8))[0]
+        elif tag == _TAG_STR:
+            yield exact(_u32.unpack(exact(4))[0]).decode("utf-8")
+        elif tag == _TAG_BYTES:
+            yield exact(_u32.unpack(exact(4))[0])
+        elif tag == _TAG_NONE:
+            yield None
+        elif tag == _TAG_TRUE or tag == _TAG_FALSE:
+            yield tag == _TAG_TRUE
+        elif tag == _TAG_PICKLE:
+            yield _pickle.loads(exact(_u32.unpack(exact(4))[0]))
+        else:
+            raise ValueError(f"unknown record tag {tag}")
+
+
+# async counterparts. functions passed to them may be sync or async,
+# sync iterables are accepted wherever async ones are.
+
+
+def as_aiterator(
+    i: _t.Union[_t.Iterable[_T], _t.AsyncIterable[_T]],
+) -> _t.AsyncIterator[_T]:
+    if hasattr(i, "__anext__"):
+        return i
+    if hasattr(i, "__aiter__"):
+        return i.__aiter__()
+    return _aiter_sync(i)
+
+
+async def _aiter_sync(xs: _t.Iterable[_T]) -> _t.AsyncIterator[_T]:
+    for x in xs:
+        yield x
+
+
+def is_aiterable(any) -> bool:
+    return hasattr(any, "__aiter__") or hasattr(any, "__iter__")
+
+
+async def _maybe_await(x):
+    return (await x) if _isawaitable(x) else x
+
+
+async def alist(xs: _t.Union[_t.Iterable[_T], _t.AsyncIterable[_T]]) -> _t.List[_T]:
+    return [x async for x in as_aiterator(xs)]
+
+
+async def atake(n: int, xs: _t.AsyncIterable[_T]) -> _t.AsyncIterator[_T]:
+    if n <= 0:
+        return
+    async for x in as_aiterator(xs):
+        yield x
+        n -= 1
+        if n == 0:
+            return
+
+
+async def askip(n: int, xs: _t.AsyncIterable[_T]) -> _t.AsyncIterator[_T]:
+    async for x in as_aiterator(xs):
+        if n > 0:
+            n -= 1
+            continue
+        yield x
+
+
+async def afiltermap(
+    fn: _F[[_T], _t.Optional[_T1]], 
+    xs: _t.AsyncIterable[_T],
+) -> _t.AsyncIterator[_T1]:
+    async for x in as_aiterator(xs):
+        y = await _maybe_await(fn(x))
+        if y is None:
+            continue
+        yield y
+
+
+async def azip_w_next(xs: _t.AsyncIterable[_T]) -> _t.AsyncIterator[_t.Tuple[_T, _T]]:
+    first = True
+    prev = None
+    async for i in as_aiterator(xs):
+        if first:
+            first = False
+            prev = i
+            continue
+        yield (prev, i)
+        prev = i
+
+
+async def aunfold(
+    start: _T, 
+    update: _F[[_T], _T],
+    *, yield_first=False, 
+    sentinel=None,
+) -> _t.AsyncIterator[_T]:
+    """async `unfold`, `update` may be a coroutine function"""
+    if yield_first:
+        yield start
+    while True:
+        start = await _maybe_await(update(start))
+        if start == sentinel:
+            break
+        yield start
+
+
+async def aflatten(
+    xs: _t.AsyncIterable[_t.Union[_T, "recursive"]], *,
+    recur_when: _F[[_t.Union[_T, "recursive"]], bool] = is_aiterable,
+    as_aiterator = as_aiterator,
+    braces = False,
+) -> _t.AsyncIterator[_t.Union[_T, _Brace]]:
+    """async `flatten`, nested objects may be sync or async iterables"""
+    stack = [as_aiterator(xs), ]
+    if braces:
+        yield _Brace(0, True)
+    while stack:
+        xs = stack[-1]
+        lvl = len(stack)
+        async for x in xs:
+            if recur_when(x):
+                if braces:
+                    yield _Brace(lvl, True)
+                stack.append(as_aiterator(x))
+                break
+            else:
+                yield x
+        else:
+            stack.pop()
+            if braces:
+                yield _Brace(lvl-1, False)
+
+
+async def abuffer(xs: _t.AsyncIterable[_T], n: int) -> _t.AsyncIterator[_T]:
+    """
+    decouple pipeline stages: upstream runs as a separate task 
+    and may run at most `n` items ahead of the consumer (backpressure).
+    upstream exceptions are re-raised in the consumer,
+    upstream task is cancelled when the consumer stops early.
+    """
+    assert n > 0, "buffer size must be positive"
+    q = _asyncio.Queue(maxsize=n)
+    done = object()
+    async def produce():
+        try:
+            async for x in as_aiterator(xs):
+                await q.put((x, None))
+            await q.put((done, None))
+        except _asyncio.CancelledError:  # an `Exception` on 3.7, must not be swallowed
+            raise
+        except Exception as e:
+            await q.put((done, e))
+    task = _asyncio.ensure_future(produce())
+    try:
+        while True:
+            x, e = await q.get()
+            if x is done:
+                if e is not None:
+                    raise e
+                return
+            yield x
+    finally:
+        task.cancel()
+
+
+async def amap(
+    fn: _F[[_T], _t.Union[_T1, _t.Awaitable[_T1]]], 
+    xs: _t.AsyncIterable[_T], *,
+    limit: int = 8,
+    ordered: bool = True,
+) -> _t.AsyncIterator[_T1]:
+    """
+    apply (coroutine) function `fn` to `xs` with at most `limit` calls in flight.
+    upstream is not pulled while `limit` calls are pending (backpressure).
+    `ordered=False` yields results as soon as they are ready.
+    """
+    assert limit > 0, "limit must be positive"
+    xs = as_aiterator(xs)
+    pending = _deque() if ordered else set()
+    add = pending.append if ordered else pending.add
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < limit:
+                try:
+                    x = await xs.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    add(_asyncio.ensure_future(_maybe_await(fn(x))))
+            if not pending:
+                return
+            if ordered:
+                yield await pending.popleft()
+            else:
+                done, pending = await _asyncio.wait(
+                    pending, return_when=_asyncio.FIRST_COMPLETED)
+                add = pending.add
+                for task in done:
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# background workers talk to consumers with builtin-only messages,
+# so they survive pickling: `list` is a chunk of items,
+# an exception instance is re-raised, `None` marks the end.
+
+
+def _put_until(q, msg, stop) -> bool:
+    """put `msg` into bounded `q` unless `stop` gets set while waiting"""
+    while not stop.is_set():
+        try:
+            q.put(msg, timeout=0.05)
+            return True
+        except _queue.Full:
+            pass
+    return False
+
+
+def _produce(xs: _t.Iterable, q, stop, chunk: int) -> None:
+    try:
+        xs = iter(xs)
+        while True:
+            items = list(islice(xs, chunk))
+            if not items or not _put_until(q, items, stop):
+                break
+        msg = None
+    except Exception as e:
+        msg = e
+    _put_until(q, msg, stop)
+    if stop.is_set() and hasattr(q, "cancel_join_thread"):
+        q.cancel_join_thread()  # consumer is gone, do not wait for it to read
+
+
+class _Prefetched:
+    """consumer side of `prefetch`. `close` (or garbage collection) stops the worker"""
+    __slots__ = ("q", "stop", "worker", "buf")
+
+    def __init__(self, q, stop, worker):
+        self.q = q
+        self.stop = stop
+        self.worker = worker
+        self.buf = _deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.buf:
+            if self.worker is None:  # closed
+                raise StopIteration
+            try:
+                msg = self.q.get(timeout=0.1)
+            except _queue.Empty:
+                worker = self.worker
+                if not worker.is_alive() and self.q.empty():
+                    self.close()
+                    raise RuntimeError(f"prefetch worker died (exitcode={getattr(worker, 'exitcode', None)})")
+                continue
+            if type(msg) is list:
+                self.buf.extend(msg)
+            elif msg is None:
+                self.close()
+                raise StopIteration
+            else:
+                self.close()
+                raise msg
+        return self.buf.popleft()
+
+    def close(self) -> None:
+        worker, self.worker = self.worker, None
+        if worker is None:
+            return
+        self.stop.set()
+        self.buf.clear()
+        worker.join(timeout=1)
+        if hasattr(worker, "terminate") and worker.is_alive():  # a process
+            worker.terminate()
+
+    def __del__(self):
+        self.close()
+
+
+def prefetch(
+    itr: _t.Iterable[_T], 
+    n: int, 
+    kind: str = "thread", *,
+    chunk: int = 1,
+) -> _t.Iterator[_T]:
+    """
+    run `itr` in a background worker that reads up to `n` chunks 
+    (of `chunk` items) ahead of the consumer.
+    kind="thread" suits io-bound and GIL-releasing producers,
+    kind="process" suits cpu-bound ones (items are pickled, so use bigger `chunk`).
+    the process is forked, since the worker runs this path-loaded module,
+    so `itr` need not be picklable; raises `RuntimeError` where fork is unavailable.
+    exceptions are re-raised in the consumer. 
+    closing the returned iterator (or dropping it) stops the worker.
+    ```
+    for x in prefetch(map(decompress, read_blocks(path)), 8):
+        process(x)
+    ```
+    """
+    assert n > 0 and chunk > 0, "n and chunk must be positive"
+    if kind == "thread":
+        q, stop = _queue.Queue(maxsize=n), _threading.Event()
+        worker = _threading.Thread(target=_produce, args=(itr, q, stop, chunk), daemon=True)
+    elif kind == "process":
+        try:
+            ctx = _mp.get_context("fork")
+        except ValueError:
+            raise RuntimeError("prefetch(kind='process') needs the 'fork' start method") from None
+        q, stop = ctx.Queue(maxsize=n), ctx.Event()
+        worker = ctx.Process(target=_produce, args=(itr, q, stop, chunk), daemon=True)
+    else:
+        raise ValueError(f"kind must be 'thread' or 'process', got {kind!r}")
+    worker.start()
+    return _Prefetched(q, stop, worker)
+
+
+class StageStats:
+    """
+    counters of an instrumented pipeline stage. 
+    `self_ns` excludes time spent in instrumented upstream stages,
+    `hist` counts `__next__` calls by self time (in ns): below 8 ns exactly, 
+    above that in 8 buckets per power of two, `hist[bits << 3 | next 3 bits]`
+    """
+    __slots__ = ("name", "count", "self_ns", "total_ns", "hist")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.self_ns = 0
+        self.total_ns = 0
+        self.hist = [0] * (65 << 3)
+
+    def items_per_s(self) -> float:
+        return self.count / self.self_ns * 1e9 if self.self_ns else float("inf")
+
+    def percentile(self, q: float) -> float:
+        """`q`-th (0..100) self latency percentile, seconds, interpolated within its bucket (1/8 of an octave)"""
+        rank = q / 100 * self.count
+        acc = 0
+        for k, n in enumerate(self.hist):
+            if n and acc + n >= rank:
+                if k < 8:
+                    return k * 1e-9
+                shift = (k >> 3) - 4
+                lo, width = (8 | k & 7) << shift, 1 << shift
+                return (lo + width * max(rank - acc, 0) / n) * 1e-9
+            acc += n
+        return 0.
+
+    def __repr__(self) -> str:
+        return f"<StageStats {self.name} items={self.count} self={self.self_ns * 1e-9:.3g}s>"
+
+
+class _StageStack(_threading.local):
+    def __init__(self):
+        self.frames = []  # time spent in nested (upstream) stages, per active stage
+
+
+_stage_stack = _StageStack()
+STAGES: _t.Dict[str, StageStats] = dict()
+
+
+class _Instrumented:
+    __slots__ = ("itr", "stats")
+
+    def __init__(self, itr: _t.Iterator, stats: StageStats):
+        self.itr = itr
+        self.stats = stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        frames = _stage_stack.frames
+        frames.append(0)
+        t0 = _perf_ns()
+        try:
+            x = next(self.itr)
+        finally:
+            dt = _perf_ns() - t0
+            upstream = frames.pop()
+            if frames:
+                frames[-1] += dt
+        s = self.stats
+        dt_self = dt - upstream
+        s.count += 1
+        s.self_ns += dt_self
+        s.total_ns += dt
+        b = dt_self.bit_length()
+        s.hist[b << 3 | dt_self >> (b - 4) & 7 if b > 3 else dt_self] += 1
+        return x
+
+
+def instrument(itr: _t.Iterable[_T], name: str) -> _t.Iterator[_T]:
+    """
+    count items and time spent in `next(itr)` under `STAGES[name]`
+    (stages with the same name are accumulated).
+    time spent in instrumented upstream stages is excluded, so wrap every stage:
+    ```
+    xs = instrument(filtermap(parse, lines), "parse")
+    xs = instrument(flatten(xs), "flatten")
+    xs = instrument(zip_w_next(xs), "pairs")
+    foreach(xs)
+    print(stages_report())
+    ```
+    """
+    stats = STAGES.get(name)
+    if stats is None:
+        stats = STAGES[name] = StageStats(name)
+    return _Instrumented(as_iterator(itr), stats)
+
+
+def stages_report(names: _t.Iterable[str] = None) -> str:
+    """table of `STAGES`: items, self time, throughput and self latency percentiles"""
+    rows = [STAGES[n] for n in (STAGES if names is None else names)]
+    us = lambda s: f"{s * 1e6:.3g}"
+    lines = [f"{'stage':<16}{'items':>12}{'self, s':>10}{'items/s':>12}{'p50, us':>10}{'p90, us':>10}{'p99, us':>10}"]
+    for s in rows:
+        lines.append(
+            f"{s.name:<16}{s.count:>12}{s.self_ns * 1e-9:>10.3g}{s.items_per_s():>12.3g}"
+            f"{us(s.percentile(50)):>10}{us(s.percentile(90)):>10}{us(s.percentile(99)):>10}"
+        )
+    return "\n".join(lines)
+
+
+def reset_stages() -> None:
+    STAGES.clear()
+
+
+class _Broadcast:
+    """shared state of `broadcast` consumers"""
+    __slots__ = ("src", "buf", "base", "pos", "maxlag", "cond", "pulling", "done", "exc")
+
+    def __init__(self, src: _t.Iterator, k: int, maxlag: _t.Optional[int]):
+        self.src = src
+        self.buf = _deque()
+        self.base = 0  # index of buf[0] in the source stream
+        self.pos = [0] * k  # next index for every consumer, inf when closed
+        self.maxlag = float("inf") if maxlag is None else maxlag
+        self.cond = _threading.Condition()
+        self.pulling = False
+        self.done = False
+        self.exc = None
+
+    def _trim(self) -> None:
+        """drop items every consumer has seen, wake up consumers waiting on lag"""
+        slowest = min(self.pos)
+        buf = self.buf
+        if not buf or self.base >= slowest:
+            return
+        while buf and self.base < slowest:
+            buf.popleft()
+            self.base += 1
+        self.cond.notify_all()
+
+    def next(self, j: int):
+        cond = self.cond
+        with cond:
+            while True:
+                i = self.pos[j]
+                if i < self.base + len(self.buf):
+                    x = self.buf[i - self.base]
+                    self.pos[j] = i + 1
+                    self._trim()
+                    return x
+                if self.done:
+                    if self.exc is not None:
+                        raise self.exc
+                    raise StopIteration
+                if self.pulling or i - min(self.pos) >= self.maxlag:
+                    cond.wait()
+                    continue
+                self.pulling = True
+                cond.release()
+                try:
+                    x = next(self.src)
+                except StopIteration:
+                    self.done = True
+                except Exception as e:
+                    self.done, self.exc = True, e
+                else:
+                    self.buf.append(x)
+                finally:
+                    cond.acquire()
+                    self.pulling = False
+                    cond.notify_all()
+
+    def close(self, j: int) -> None:
+        with self.cond:
+            self.pos[j] = float("inf")
+            self._trim()
+
+
+class _BroadcastReader:
+    """one consumer of `broadcast`. `close` (or garbage collection) releases its place"""
+    __slots__ = ("state", "j")
+
+    def __init__(self, state: _Broadcast, j: int):
+        self.state = state
+        self.j = j
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.state.pos[self.j] == float("inf"):
+            raise StopIteration
+        try:
+            return self.state.next(self.j)
+        except BaseException:  # StopIteration too
+            self.close()
+            raise
+
+    def close(self) -> None:
+        self.state.close(self.j)
+
+    def __del__(self):
+        self.close()
+
+
+def broadcast(
+    itr: _t.Iterable[_T], 
+    k: int, *,
+    maxlag: _t.Optional[int] = None,
+) -> _t.List[_t.Iterator[_T]]:
+    """
+    `tee` for consumers in different threads: `k` iterators over the same items.
+    at most `maxlag` items are buffered between the slowest and the fastest consumer,
+    faster ones block until the slowest catches up (None means unbounded, as `tee`).
+    consumers that may drift apart by `maxlag` must run in separate threads,
+    otherwise they deadlock. closed consumers no longer hold the others back.
+    upstream exceptions are re-raised in every consumer.
+    """
+    assert k > 0, "k must be positive"
+    assert maxlag is None or maxlag > 0, "maxlag must be positive or None"
+    state = _Broadcast(iter(itr), k, maxlag)
+    return [_BroadcastReader(state, j) for j in range(k)]
+
+
+class ShardReader:
+    """
+    consumer side of a `shard`: iterate it in a worker process
+    (pass it to `multiprocessing.Process` args). 
+    stopping early stops the whole feed: 
+    other readers then raise `RuntimeError` instead of ending as if complete.
+    """
+    __slots__ = ("q", "stop")
+
+    def __init__(self, q, stop):
+        self.q = q
+        self.stop = stop
+
+    def __iter__(self) -> _t.Iterator:
+        q, stop = self.q, self.stop
+        finished = False
+        try:
+            while True:
+                try:
+                    msg = q.get(timeout=0.1)
+                except _queue.Empty:
+                    if stop.is_set():
+                        finished = True
+                        raise RuntimeError("shard feed stopped by another reader")
+                    continue
+                if type(msg) is list:
+                    yield from msg
+                elif msg is None:
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise msg
+        finally:
+            if not finished:
+                stop.set()
+
+
+def _feed_shards(
+    xs: _t.Iterable, qs: list, stop, 
+    key: _t.Optional[_F], chunk: int,
+) -> None:
+    n = len(qs)
+    pending = [[] for _ in qs]
+    msg = None
+    try:
+        for i, x in enumerate(xs):
+            j = i % n if key is None else hash(key(x)) % n
+            p = pending[j]
+            p.append(x)
+            if len(p) >= chunk:
+                if not _put_until(qs[j], p, stop):
+                    break
+                pending[j] = []
+    except Exception as e:
+        msg = e
+    for q, p in zip(qs, pending):
+        if p and msg is None:
+            _put_until(q, p, stop)
+        _put_until(q, msg, stop)
+    if stop.is_set():
+        for q in qs:
+            q.cancel_join_thread()  # readers are gone, do not wait for them
+
+
+def shard(
+    itr: _t.Iterable[_T], 
+    workers: int, *,
+    key: _F[[_T], _t.Hashable] = None,
+    maxsize: int = 16,
+    chunk: int = 1,
+) -> _t.List[ShardReader]:
+    """
+    distribute items of `itr` between `workers` process queues 
+    (of at most `maxsize` chunks of `chunk` items each),
+    round-robin or by `hash(key(item))`, so equal keys end up in one worker.
+    `itr` is consumed by a background thread of this process,
+    which waits while any queue is full, so readers must run concurrently.
+    ```
+    readers = shard(read_records(path), 4, key=lambda r: r.user_id, chunk=256)
+    procs = [multiprocessing.Process(target=work, args=(r, )) for r in readers]
+    ```
+    with non-fork start methods this module must be importable by the workers.
+    """
+    assert workers > 0 and maxsize > 0 and chunk > 0
+    qs = [_mp.Queue(maxsize=maxsize) for _ in range(workers)]
+    stop = _mp.Event()
+    feeder = _threading.Thread(
+        target=_feed_shards, args=(itr, qs, stop, key, chunk), daemon=True)
+    feeder.start()
+    return [ShardReader(q, stop) for q in qs]
@@ -3,6 +3,9 @@ import sys
 import numpy as np
 import typing as _t
 import operator
+import multiprocessing as _mp
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
 
 su = sys.startup
 itr,  = su.require_plugins("iterators")
@@ -28,6 +31,15 @@ def __test_is_monotonic():
     assert is_monotonic(a([4, 3, 2, 1]), increasing=False)
 
 
+# numpy reductions that take `axis` and `out`: 
+# `Window.apply` calls them once over a strided view of all windows
+# (matched by identity: `fn` may be any callable, hashable or not)
+_WINDOW_REDUCERS = tuple(getattr(np, name) for name in (
+    "argmax", "argmin", "max", "amax", "min", "amin", "ptp", 
+    "sum", "prod", "mean", "std", "var", "median", "any", "all",
+) if hasattr(np, name))
+
+
 class Window:
     """
     Sliding window iterator over 1D array. example:
@@ -49,9 +61,41 @@ class Window:
         return (self.array[i:i + self.window] for i in self.range)
     
     @staticmethod
-    def apply(fn: callable, array: np.ndarray, window: int, start: int = 0, stop: int = None) -> np.ndarray:
-        """applies fn to the sliding window and stacks results"""
-        return np.stack([fn(w) for w in Window(array, window, start, stop)])
+    def apply(
+        fn: callable, 
+        array: np.ndarray, 
+        window: int, 
+        start: int = 0, 
+        stop: int = None, *, 
+        out: np.ndarray = None, 
+        chunk: int = None,
+    ) -> np.ndarray:
+        """
+        applies fn to the sliding window and stacks results.
+        for numpy reductions (`np.argmax`, `np.mean`, etc.) over 1D arrays
+        fn is called along the window axis of a zero-copy strided view,
+        `chunk` windows at a time (reductions may copy the windows they get, 
+        by default a chunk holds about 2**20 samples). `out` receives the results
+        """
+        full = len(array) - window + 1  # windows past it are shorter
+        if not (any(fn is r for r in _WINDOW_REDUCERS) and isinstance(array, np.ndarray) and array.ndim == 1
+                and (stop is None or stop <= full)):
+            return np.stack([fn(w) for w in Window(array, window, start, stop)], out=out)
+        stop = full if stop is None else stop 
+        assert start >= 0 and stop > 0, "start, stop must be positive or None"
+        views = sliding_window_view(array, window)[start:stop]
+        n = len(views)
+        chunk = max(2**20 // window, 1) if chunk is None else chunk
+        if out is None:
+            head = fn(views[:chunk], axis=-1)
+            out = np.empty(n, dtype=head.dtype)
+            out[:len(head)] = head
+            b = len(head)
+        else:
+            b = 0
+        for b in range(b, n, chunk):
+            fn(views[b:b + chunk], axis=-1, out=out[b:b + chunk])
+        return out
     
     # did you know, you can nest classes? OOP world is very perverted
     class Fn(_t.NamedTuple):
@@ -72,6 +116,9 @@ class extrema(metaclass=su.Module):
     module with extremum-finding functions.
     most useful functions:
     * find
+    * find_many (for many signals)
+    * Stream (for signals that arrive in chunks)
+    * prominence, width, valleys (for the found maxima)
     common function arguments:
     x: np.ndarray, 1D, discrete curve
     extr: extrema array (indices for x)
@@ -79,34 +126,129 @@ class extrema(metaclass=su.Module):
     is_max: bool, search for maximum or minimum
     """
     # uses: Window, fp.Static
+    def _running_arg(x: np.ndarray, is_max: bool, ties_last: bool) -> np.ndarray:
+        """
+        along the last axis: index of the extremum of `x[..., :k+1]` for every k.
+        first of equal extrema, or the last one with `ties_last`
+        """
+        run = (np.maximum if is_max else np.minimum).accumulate(x, axis=-1)
+        if is_max:
+            new = (x[..., 1:] >= run[..., :-1]) if ties_last else (x[..., 1:] > run[..., :-1])
+        else:
+            new = (x[..., 1:] <= run[..., :-1]) if ties_last else (x[..., 1:] < run[..., :-1])
+        j = np.arange(x.shape[-1])
+        idx = np.where(new, j[1:], 0)
+        idx = np.concatenate([np.zeros((*x.shape[:-1], 1), dtype=idx.dtype), idx], axis=-1)
+        idx = np.maximum.accumulate(idx, axis=-1)
+        nan = np.isnan(x) if x.dtype.kind in "fc" else None
+        if nan is not None and nan.any():  # as argmax, the first nan wins (the last with `ties_last`)
+            if ties_last:
+                at = np.maximum.accumulate(np.where(nan, j, -1), axis=-1)
+            else:
+                at = np.minimum.accumulate(np.where(nan, j, len(j)), axis=-1)
+            idx = np.where(nan.cumsum(axis=-1) > 0, at, idx)
+        return idx
+
+    def prefix_arg(x: np.ndarray, *, is_max: bool = True) -> np.ndarray:
+        """along the last axis: `argmax(x[..., :k+1])` (or argmin) for every k, O(n)"""
+        return extrema._running_arg(x, is_max, False)
+
+    def suffix_arg(x: np.ndarray, *, is_max: bool = True) -> np.ndarray:
+        """along the last axis: `k + argmax(x[..., k:])` (or argmin) for every k, O(n)"""
+        n = x.shape[-1]
+        return (n - 1) - extrema._running_arg(x[..., ::-1], is_max, True)[..., ::-1]
+
+    def _window_arg(x: np.ndarray, w: int, is_max: bool) -> np.ndarray:
+        """index (in `x`, along the last axis) of the extremum of every `w`-window of `x`"""
+        n = x.shape[-1]
+        m = n - w + 1
+        if x.dtype.kind in "fc" and np.isnan(x).any():  # argmax picks the first nan
+            argfind = np.argmax if is_max else np.argmin
+            rows = [Window.apply(argfind, r, w) for r in x.reshape(-1, n)]
+            return np.stack(rows).reshape(*x.shape[:-1], m) + np.arange(m)
+        nb = -(-n // w)
+        # padding repeats the last sample, so it never beats a real sample
+        xp = np.concatenate([x, np.repeat(x[..., -1:], nb * w - n, axis=-1)], axis=-1)
+        blocks = xp.reshape(*x.shape[:-1], nb, w)
+        offsets = (np.arange(nb) * w)[:, np.newaxis]
+        lead = x.shape[:-1]
+        g = (extrema.prefix_arg(blocks, is_max=is_max) + offsets).reshape(*lead, nb * w)
+        h = (extrema.suffix_arg(blocks, is_max=is_max) + offsets).reshape(*lead, nb * w)
+        a, b = h[..., :m], g[..., w - 1:w - 1 + m]
+        xa, xb = np.take_along_axis(xp, a, axis=-1), np.take_along_axis(xp, b, axis=-1)
+        take_a = (xa >= xb) if is_max else (xa <= xb)
+        return np.where(take_a, a, b)
+
+    def _window_arg_pieces(
+        x: np.ndarray, 
+        w: int, 
+        is_max: bool, 
+        piece: int = 2**20,
+    ) -> _t.Iterator[_t.Tuple[int, np.ndarray]]:
+        """
+        `_window_arg` in pieces of about `piece` samples (of all rows) 
+        and `w - 1` samples of overlap, so temporaries stay small.
+        yields `(b, arg)` for windows `b, b + 1, ...`
+        """
+        n = x.shape[-1]
+        m = n - w + 1
+        step = max(piece * n // max(x.size, 1), w)  # longer windows would be read too often
+        for b in range(0, m, step):
+            yield b, b + extrema._window_arg(x[..., b:min(b + step, m) + w - 1], w, is_max)
+
+    def sliding_arg(x: np.ndarray, w: int, *, is_max: bool = True) -> np.ndarray:
+        """
+        same as `Window.apply(np.argmax, x, w)` (or np.argmin), but O(n) for any `w`
+        (van Herk/Gil-Werman: the max of a window is the max of a block suffix 
+        and the next block prefix). works along the last axis, in pieces
+        """
+        n = x.shape[-1]
+        assert 0 < w <= n, "window must fit into x"
+        out = np.empty((*x.shape[:-1], n - w + 1), dtype=np.intp)
+        for b, arg in extrema._window_arg_pieces(x, w, is_max):
+            k = arg.shape[-1]
+            np.subtract(arg, np.arange(b, b + k), out=out[..., b:b + k])
+        return out
+
+    def centered_arg(x: np.ndarray, w2: int, *, is_max: bool = True) -> np.ndarray:
+        """
+        for every index `ex` along the last axis: index of the (first) extremum
+        of `x[max(ex-w2, 0):min(ex+w2, n)]`, O(n)
+        """
+        n = x.shape[-1]
+        assert n > 2 * w2 > 0, "x seems to short or w/2 is too big"
+        w = 2 * w2
+        c = np.empty(x.shape, dtype=np.intp)
+        for b, arg in extrema._window_arg_pieces(x, w, is_max):
+            c[..., w2 + b:w2 + b + arg.shape[-1]] = arg
+        c[..., :w2] = extrema.prefix_arg(x[..., :w], is_max=is_max)[..., w2 - 1:w - 1]
+        c[..., n - w2 + 1:] = (n - w) + extrema.suffix_arg(x[..., n - w:], is_max=is_max)[..., 1:w2]
+        return c
+
     def crude_find(
         x: np.ndarray, 
         w2: int, *, 
         is_max: bool = True,
     ) -> np.ndarray:
-        argfind = np.argmax if is_max else np.argmin
         w = w2*2
-        extr = Window.apply(argfind, x, w)
-        extr = extr + np.arange(len(extr))
-        return np.unique(extr)
-
+        pieces = [np.unique(arg) for _, arg in extrema._window_arg_pieces(x, w, is_max)]
+        return np.unique(np.concatenate(pieces))
 
     def filter_(
         extr: _t.Iterable[int], 
         x: np.ndarray, 
         w2: int, *, 
         is_max: bool = True,
+        centered: np.ndarray = None,
     ) -> np.ndarray:
-        fn_extr = np.max if is_max else np.min
-        n = len(x)
-        extr2 = []
-        for ex in extr:
-            b, e = ex - w2, ex + w2
-            b = b if b >= 0 else 0
-            e = e if e < n else n
-            if fn_extr(x[b:e]) == x[ex]:
-                extr2.append(ex)
-        return np.unique(extr2)
+        """
+        keep extrema `extr` that are extrema of `x[ex-w2:ex+w2]`.
+        `centered` is `centered_arg(x, w2, is_max=is_max)`, if already known
+        """
+        if centered is None:
+            centered = extrema.centered_arg(x, w2, is_max=is_max)
+        extr = np.asarray(extr, dtype=np.intp)
+        return np.unique(extr[x[centered[extr]] == x[extr]])
 
     def refine(
         extr: _t.Iterable[int], 
@@ -114,24 +256,21 @@ class extrema(metaclass=su.Module):
         w2: int, *, 
         n_iter: int = 5, 
         is_max: bool = True,
+        centered: np.ndarray = None,
     ) -> np.ndarray:
         """
         iteratively adjust position of extrema `extr` on the curve `x`.
-        for each extremum index `ex` search `x[ex-w2:ex+w2]` area for a better extremum
-        """
-        argfind = np.argmax if is_max else np.argmin
-        n = len(x)
-        extr2 = []
-        for ex in extr:
-            for _ in range(n_iter):
-                b, e = ex - w2, ex + w2
-                b = b if b >= 0 else 0
-                e = e if e < n else n
-                ex, ex_prev = (argfind(x[b:e]) + b), ex
-                if ex == ex_prev:
-                    break
-            extr2.append(ex)
-        return np.unique(extr2)
+        for each extremum index `ex` search `x[ex-w2:ex+w2]` area for a better extremum.
+        `centered` is `centered_arg(x, w2, is_max=is_max)`, if already known
+        """
+        if centered is None:
+            centered = extrema.centered_arg(x, w2, is_max=is_max)
+        extr = np.asarray(extr, dtype=np.intp)
+        for _ in range(n_iter):
+            extr, prev = centered[extr], extr
+            if np.array_equal(extr, prev):
+                break
+        return np.unique(extr)
 
     def find(
         x: np.ndarray, 
@@ -141,11 +280,133 @@ class extrema(metaclass=su.Module):
     ) -> np.ndarray:
         """The primary function. x |> crude_find |> filter |> refine"""
         assert len(x) > w2*2, "x seems to short or w/2 is too big"
+        centered = extrema.centered_arg(x, w2, is_max=is_max)
         extr = extrema.crude_find(x, w2, is_max=is_max)
-        extr = extrema.filter_(extr, x, w2, is_max=is_max)
-        extr = extrema.refine(extr, x, w2, n_iter=refine_n_iter, is_max=is_max)
+        extr = extrema.filter_(extr, x, w2, is_max=is_max, centered=centered)
+        extr = extrema.refine(extr, x, w2, n_iter=refine_n_iter, is_max=is_max, centered=centered)
         return extr
     
+    def _find_rows(
+        x: np.ndarray, 
+        w2: int, 
+        is_max: bool, 
+        refine_n_iter: int,
+    ) -> _t.Tuple[np.ndarray, np.ndarray]:
+        """`find` for every row of 2D `x` at once. returns (extrema, counts per row)"""
+        m = len(x)
+        centered = extrema.centered_arg(x, w2, is_max=is_max)
+        mask = np.zeros(x.shape, dtype=bool)
+        for _, crude in extrema._window_arg_pieces(x, 2 * w2, is_max):
+            np.put_along_axis(mask, crude, True, axis=-1)
+        row, extr = np.nonzero(mask)  # unique and sorted within rows
+        keep = x[row, centered[row, extr]] == x[row, extr]
+        row, extr = row[keep], extr[keep]
+        for _ in range(refine_n_iter):
+            extr, prev = centered[row, extr], extr
+            if np.array_equal(extr, prev):
+                break
+        mask[:] = False
+        mask[row, extr] = True
+        row, extr = np.nonzero(mask)
+        return extr, np.bincount(row, minlength=m)
+
+    def find_many(
+        xs: _t.Union[np.ndarray, _t.Iterable[np.ndarray]], 
+        w2: int, *, 
+        is_max: bool = True, 
+        refine_n_iter: int = 5,
+        chunk: int = None,
+        processes: int = None,
+    ) -> _t.Tuple[np.ndarray, np.ndarray]:
+        """
+        `find` for many signals: a 2D (signals, samples) array 
+        or 1D arrays of any lengths.
+        signals of equal length are processed `chunk` rows at a time 
+        with whole-array ops (by default, a chunk holds about 2**14 samples, 
+        so it stays in cache).
+        with `processes`, chunks go to a pool of that many forked workers
+        (plugins are loaded by path, so workers only find this one under `fork`;
+        raises `RuntimeError` where it is unavailable, e.g. on Windows).
+        returns ragged `(extr, offsets)`: 
+        extrema of signal `i` are `extr[offsets[i]:offsets[i+1]]`
+        """
+        if isinstance(xs, np.ndarray) and xs.ndim == 2:
+            groups = [(np.arange(len(xs)), xs)]
+        else:
+            xs = [np.asarray(x) for x in xs]
+            by_len = dict()
+            for i, x in enumerate(xs):
+                by_len.setdefault(len(x), []).append(i)
+            groups = [(np.array(idx), np.stack([xs[i] for i in idx])) for idx in by_len.values()]
+        assert all(x.shape[1] > 2 * w2 for _, x in groups), "x seems to short or w/2 is too big"
+        jobs = []
+        for idx, x in groups:
+            step = chunk or max(2**14 // x.shape[1], 1)
+            jobs.extend((idx[b:b + step], x[b:b + step]) for b in range(0, len(x), step))
+        args = ([x for _, x in jobs], *([a] * len(jobs) for a in (w2, is_max, refine_n_iter)))
+        if processes is None:
+            results = list(map(extrema._find_rows, *args))
+        else:
+            try:
+                ctx = _mp.get_context("fork")
+            except ValueError:
+                raise RuntimeError("find_many(processes=...) needs the 'fork' start method") from None
+            with ProcessPoolExecutor(processes, mp_context=ctx) as pool:
+                results = list(pool.map(extrema._find_rows, *args))
+        n_signals = sum(len(idx) for idx, _ in groups)
+        if not jobs:
+            return np.empty(0, dtype=np.intp), np.zeros(n_signals + 1, dtype=np.intp)
+        signal = np.concatenate([np.repeat(idx, counts) for (idx, _), (_, counts) in zip(jobs, results)])
+        extr = np.concatenate([e for e, _ in results])
+        order = np.argsort(signal, kind="stable")
+        offsets = np.zeros(n_signals + 1, dtype=np.intp)
+        np.cumsum(np.bincount(signal, minlength=n_signals), out=offsets[1:])
+        return extr[order], offsets
+
+    class Stream:
+        """
+        online `find`: `push` chunks of a signal as they arrive, get indices (in the whole 
+        signal) of extrema that no later sample can change. `finish` emits the rest.
+        together, the outputs are `find` of the concatenated signal.
+        ```
+        s = extrema.Stream(w2=10)
+        extr = np.concatenate([*(s.push(c) for c in chunks), s.finish()])
+        ```
+        an extremum depends on samples up to `2*(refine_n_iter+1)*w2` away 
+        (candidate windows, then refinement steps of `w2`), so this is 
+        how long the outputs lag behind, and how much of the signal is kept
+        """
+
+        def __init__(self, w2: int, *, is_max: bool = True, refine_n_iter: int = 5):
+            self.w2 = w2
+            self.is_max = is_max
+            self.refine_n_iter = refine_n_iter
+            self.margin = 2 * (refine_n_iter + 1) * w2
+            self.buf = None
+            self.base = 0  # index of `buf[0]` in the signal
+            self.lo = 0  # extrema before it were emitted
+
+        def push(self, chunk: np.ndarray) -> np.ndarray:
+            chunk = np.asarray(chunk)
+            self.buf = chunk.copy() if self.buf is None else np.concatenate([self.buf, chunk])
+            return self._emit(self.base + len(self.buf) - self.margin)
+
+        def finish(self) -> np.ndarray:
+            assert self.buf is not None, "nothing was pushed"
+            return self._emit(self.base + len(self.buf))
+
+        def _emit(self, hi: int) -> np.ndarray:
+            if hi <= self.lo:
+                return np.empty(0, dtype=np.intp)
+            extr = self.base + extrema.find(
+                self.buf, self.w2, is_max=self.is_max, refine_n_iter=self.refine_n_iter)
+            extr = extr[(self.lo <= extr) & (extr < hi)]
+            self.lo = hi
+            drop = max(hi - self.margin - self.base, 0)
+            self.buf = self.buf[drop:].copy()
+            self.base += drop
+            return extr
+
     def join(emn: np.ndarray, emx: np.ndarray) -> _t.Tuple[np.ndarray, np.ndarray]:
         """
         join local minima indices `emn` and local maxima indices `emx`
@@ -161,6 +422,227 @@ class extrema(metaclass=su.Module):
         sorter = np.argsort(extr)
         return extr[sorter], is_max[sorter]
 
+    def valleys(
+        emn: np.ndarray, 
+        emx: np.ndarray, *, 
+        offsets: _t.Tuple[np.ndarray, np.ndarray] = None,
+    ) -> _t.Tuple[np.ndarray, np.ndarray]:
+        """
+        pair every maximum in `emx` with the nearest minima in `emn`, O(n log n).
+        returns indices of the left and the right minimum (-1 if there is none).
+        for many signals, pass ragged `emn, emx` with their `offsets=(emn_offsets, emx_offsets)`
+        (as returned by `find_many`)
+        """
+        emn, emx = np.asarray(emn, dtype=np.intp), np.asarray(emx, dtype=np.intp)
+        if offsets is not None:  # rows do not mix, if each of them takes a separate range
+            span = max(emn.max(initial=0), emx.max(initial=0)) + 1
+            row_mn, row_mx = (np.repeat(np.arange(len(o) - 1), np.diff(o)) for o in offsets)
+            emn_flat, emx_flat = emn + row_mn * span, emx + row_mx * span
+        else:
+            row_mn, row_mx = np.zeros(len(emn), dtype=np.intp), np.zeros(len(emx), dtype=np.intp)
+            emn_flat, emx_flat = emn, emx
+        if len(emn) == 0:
+            return np.full(len(emx), -1), np.full(len(emx), -1)
+        i = np.searchsorted(emn_flat, emx_flat, side="left") - 1
+        j = np.searchsorted(emn_flat, emx_flat, side="right")
+        ic, jc = np.maximum(i, 0), np.minimum(j, len(emn) - 1)
+        has_left = (i >= 0) & (row_mn[ic] == row_mx)
+        has_right = (j < len(emn)) & (row_mn[jc] == row_mx)
+        return np.where(has_left, emn[ic], -1), np.where(has_right, emn[jc], -1)
+
+    class Prominence(_t.NamedTuple):
+        prominence: np.ndarray
+        left_base: np.ndarray
+        right_base: np.ndarray
+
+    class Width(_t.NamedTuple):
+        width: np.ndarray
+        height: np.ndarray
+        left_ip: np.ndarray
+        right_ip: np.ndarray
+
+    def _last_below(
+        a: np.ndarray, 
+        start: np.ndarray, 
+        stop: np.ndarray, 
+        level: np.ndarray, 
+        strict: bool, 
+        block: int = 16,
+        chunk: int = 2**16,
+    ) -> np.ndarray:
+        """
+        for every query: the largest `i` in `[start, stop]` with `a[i] < level` 
+        (`<=` unless `strict`), `start - 1` if there is none. scans the block of `stop`,
+        then searches a sparse table of block minima, O(len(a) + n_queries * log(len(a)))
+        """
+        n = len(a)
+        less = np.less if strict else np.less_equal
+        bmin = np.minimum.reduceat(a, np.arange(0, n, block))
+        table = [bmin]
+        while 2**len(table) <= len(bmin):
+            prev, h = table[-1], 2**(len(table) - 1)
+            table.append(np.minimum(prev[:-h], prev[h:]))
+        lane = np.arange(block)
+
+        def scan(blk, lo, hi, level):  # largest hit of block `blk` in [lo, hi], or -1
+            idx = blk[:, np.newaxis] * block + lane
+            hit = (idx >= lo[:, np.newaxis]) & (idx <= hi[:, np.newaxis])
+            hit &= less(a[idx.clip(0, n - 1)], level[:, np.newaxis])
+            return np.where(hit, idx, -1).max(axis=1)
+
+        out = np.empty(len(stop), dtype=np.intp)
+        for b in range(0, len(stop), chunk):
+            s, e, lv = start[b:b + chunk], stop[b:b + chunk], level[b:b + chunk]
+            found = scan(e // block, s, e, lv)
+            q = np.nonzero((found < 0) & (e >= s))[0]
+            cur = e[q] // block  # blocks [cur, e // block) have no hits
+            for k in range(len(table) - 1, -1, -1):
+                cand = cur - 2**k
+                ok = cand >= 0
+                ok[ok] = ~less(table[k][cand[ok]], lv[q][ok])
+                cur = np.where(ok, cand, cur)
+            found[q] = scan(cur - 1, s[q], e[q], lv[q])
+            out[b:b + chunk] = np.where(found >= 0, found, s - 1)
+        return out
+
+    def _range_argmin(
+        v: np.ndarray, 
+        lo: np.ndarray, 
+        hi: np.ndarray, 
+        prefer_last: bool,
+    ) -> np.ndarray:
+        """for every query: index of the minimum of `v[lo:hi+1]`, first or last of equal ones (sparse table)"""
+
+        def pick(i, j):  # i < j, or their ranges are in this order
+            return np.where(v[j] <= v[i], j, i) if prefer_last else np.where(v[i] <= v[j], i, j)
+
+        table = [np.arange(len(v))]
+        while 2**len(table) <= len(v):
+            prev, h = table[-1], 2**(len(table) - 1)
+            table.append(pick(prev[:-h], prev[h:]))
+        start = np.cumsum([0] + [len(t) for t in table])
+        table = np.concatenate(table)
+        k = np.log2(hi - lo + 1).astype(np.intp)
+        return pick(table[start[k] + lo], table[start[k] + hi - 2**k + 1])
+
+    def _flat_peaks(
+        x: np.ndarray, 
+        emx: np.ndarray, 
+        offsets: np.ndarray,
+    ) -> _t.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """rows of `x` laid end to end: (flat x, flat peaks, row of every peak, row start of every peak)"""
+        x = np.asarray(x)
+        n = x.shape[-1]
+        if offsets is None:
+            assert x.ndim == 1, "ragged extrema of 2D x need their offsets"
+            offsets = np.array([0, len(emx)])
+        offsets = np.asarray(offsets, dtype=np.intp)
+        row = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        rs = row * n
+        return x.reshape(-1), np.asarray(emx, dtype=np.intp) + rs, row, rs
+
+    def prominence(
+        x: np.ndarray, 
+        emx: np.ndarray, *, 
+        offsets: np.ndarray = None,
+    ) -> "extrema.Prominence":
+        """
+        prominence of maxima `emx` (as in `scipy.signal.peak_prominences`) among themselves:
+        the bases are the lowest points of `x` between the peak and the nearest higher peak in `emx` 
+        (or the end of `x`) on either side, the prominence is the height over the higher base.
+        with all local maxima in `emx`, it is the usual prominence. O(n + m log m) for m maxima.
+        for minima, pass `-x`. with 2D `x`, pass ragged `emx` and `offsets` from `find_many`.
+        `emx` may come in any order within a row, results follow it. bases are indices in the rows
+        """
+        xf, p, row, rs = extrema._flat_peaks(x, emx, offsets)
+        m, n = len(p), np.shape(x)[-1]
+        n_rows = len(xf) // n if n else 0
+        if m == 0:
+            return extrema.Prominence(np.empty(0, dtype=xf.dtype), p, p)
+        # neighbouring peaks are found by position: sort within rows, scatter back at the end.
+        # rows stay grouped, since flat peaks of a row lie in [row * n, row * n + n)
+        order = np.argsort(p, kind="stable")
+        p = p[order]
+        counts = np.bincount(row, minlength=n_rows)
+        first = np.cumsum(counts) - counts  # first peak of each row
+        fi, li = first[row], first[row] + counts[row] - 1
+        ids = np.arange(m)
+        neg = -xf[p]
+        left = extrema._last_below(neg, fi, ids - 1, neg, True)  # fi - 1: none
+        right = (m - 1) - extrema._last_below(neg[::-1], (m - 1) - li, (m - 1) - ids - 1, neg, True)
+        # gaps: row head [row start, first peak], [peak, next peak], ..., tail [last peak, row end].
+        # the left gap of peak `i` is `i + row[i]`, a row with k peaks has k + 1 gaps
+        n_gaps = m + n_rows
+        starts = np.empty(n_gaps + 1, dtype=np.intp)
+        heads = first + np.arange(n_rows)
+        starts[heads] = np.arange(n_rows) * n
+        starts[ids + row + 1] = p
+        starts[-1] = len(xf)
+        lengths = np.diff(starts)
+        seg = np.repeat(np.arange(n_gaps), lengths)
+        nonempty = lengths > 0
+        gmin = np.full(n_gaps, np.inf)
+        gmin[nonempty] = np.minimum.reduceat(xf, starts[:-1][nonempty])
+        at = np.arange(len(xf))
+        hit = xf == gmin[seg]
+        g_first, g_last = np.full(n_gaps, -1), np.full(n_gaps, -1)
+        g_first[nonempty] = np.minimum.reduceat(np.where(hit, at, len(xf)), starts[:-1][nonempty])
+        g_last[nonempty] = np.maximum.reduceat(np.where(hit, at, -1), starts[:-1][nonempty])
+        # all gaps but the tails include their right end, the next peak
+        inner = np.ones(n_gaps, dtype=bool)
+        inner[heads + counts] = False
+        end = starts[1:][inner]
+        lower, same = xf[end] < gmin[inner], xf[end] == gmin[inner]
+        gmin[inner] = np.where(lower, xf[end], gmin[inner])
+        g_first[inner] = np.where(lower, end, g_first[inner])
+        g_last[inner] = np.where(lower | same, end, g_last[inner])
+        lb = g_last[extrema._range_argmin(gmin, left + 1 + row, ids + row, True)]
+        rb = g_first[extrema._range_argmin(gmin, ids + row + 1, right + row, False)]
+        prom = xf[p] - np.maximum(xf[lb], xf[rb])
+        rs = rs[order]
+        res = extrema.Prominence(np.empty_like(prom), np.empty_like(lb), np.empty_like(rb))
+        res.prominence[order], res.left_base[order], res.right_base[order] = prom, lb - rs, rb - rs
+        return res
+
+    def width(
+        x: np.ndarray, 
+        emx: np.ndarray, 
+        rel_height: float = 0.5, *, 
+        prominence: "extrema.Prominence" = None,
+        offsets: np.ndarray = None,
+    ) -> "extrema.Width":
+        """
+        width of maxima `emx` at `rel_height` of their prominence, with 
+        interpolated crossings (as in `scipy.signal.peak_widths`), O(n + m log n).
+        `prominence` is `prominence(x, emx, offsets=offsets)`, if already known.
+        `emx` may come in any order within a row, results follow it.
+        for minima, pass `-x` (and negate the heights)
+        """
+        if prominence is None:
+            prominence = extrema.prominence(x, emx, offsets=offsets)
+        xf, p, row, rs = extrema._flat_peaks(x, emx, offsets)
+        nf = len(xf)
+        lb, rb = prominence.left_base + rs, prominence.right_base + rs
+        height = xf[p] - prominence.prominence * rel_height
+        i = np.maximum(extrema._last_below(xf, lb, p, height, False), lb)
+        j = (nf - 1) - extrema._last_below(xf[::-1], (nf - 1) - rb, (nf - 1) - p, height, False)
+        j = np.minimum(j, rb)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xi, xj = xf[i], xf[j]
+            left = i + np.where(xi < height, (height - xi) / (xf[np.minimum(i + 1, nf - 1)] - xi), 0)
+            right = j - np.where(xj < height, (height - xj) / (xf[np.maximum(j - 1, 0)] - xj), 0)
+        return extrema.Width(right - left, height, left - rs, right - rs)
+
+def __test_sliding_arg():
+    x = np.array([3, 1, 3, 0, 2, 2, 5, 1, 1, 4])
+    for w in range(1, len(x) + 1):
+        assert np.all(extrema.sliding_arg(x, w) == Window.apply(np.argmax, x, w))
+        assert np.all(extrema.sliding_arg(x, w, is_max=False) == Window.apply(np.argmin, x, w))
+    w2 = 2
+    ref = [max(i-w2, 0) + np.argmax(x[max(i-w2, 0):i+w2]) for i in range(len(x))]
+    assert np.all(extrema.centered_arg(x, w2) == ref)
+
+
 class solve(metaclass=su.Module):
     """
     solutions to common equalities
@@ -187,7 +669,8 @@ class solve(metaclass=su.Module):
 # uses: itr.zip_w_next
 class spline(metaclass=su.Module):
     """
-    a bunch of spline-related stuff
+    a bunch of spline-related stuff.
+    Q is a quadratic spline, QBatch is a stack of them
     """
     def lerp(p1, p2, t) -> np.ndarray:
         """
@@ -236,29 +719,27 @@ class spline(metaclass=su.Module):
         def from_midpoints(cls, data: np.ndarray):
             "data shape must be (n, d), where n is number of points d is number of dimensions"
             assert data.ndim == 2
-            knots = np.stack([
-                data[0], 
-                *((p1+p2)/2 for p1, p2 in itr.zip_w_next(data)), 
-                data[-1],
-            ])
+            knots = np.concatenate([data[:1], (data[:-1] + data[1:]) / 2, data[-1:]])
             return cls(data.copy(), knots)
         
         def project_variable(self, x: np.ndarray, var_no: int = 0):
             """
             project x (1-d array) values onto t-space (distance along the spline)
             trim values that do not fall into handles range
-            knots in this dimension must be monothonic
+            knots in this dimension must be monothonic.
+            segments are found with one `np.searchsorted`, so it is O(n log k) for k segments
             """
             handles = self.handles[:, var_no]
             knots = self.knots[:, var_no]
-            assert is_monotonic(knots) or is_monotonic(knots, increasing=False), f"self.knots[{var_no}] are not monotonic"
+            increasing = is_monotonic(knots)
+            assert increasing or is_monotonic(knots, increasing=False), f"self.knots[{var_no}] are not monotonic"
             x = x[(np.min(handles) <= x) & (x < np.max(handles))]
-            t = np.empty_like(x)
-            segms = [ (k1<=x) & (x<k2) for k1, k2 in itr.zip_w_next(knots)]
-            segms[-1] = segms[-1] | (x == knots[-1])
-            for i, (segm, (k1, k2), h) in enumerate(zip(segms, itr.zip_w_next(knots), handles)):
-                t[segm] = i + self.invert_segment(k1, h, k2, x[segm])
-            return t
+            if increasing:
+                i = np.searchsorted(knots, x, side="right") - 1
+            else:
+                i = np.searchsorted(-knots, -x, side="right") - 1
+            i = np.clip(i, 0, len(handles) - 1)
+            return i + self.invert_segments(knots[i], handles[i], knots[i + 1], x)
         
         def __repr__(self) -> str:
             return f"<{self.__class__.__name__} at {hex(id(self))}>"
@@ -275,45 +756,77 @@ class spline(metaclass=su.Module):
             for knots `x1, x3`, handle `x2` 
             and observed values `xs` at certain segment.
             """    
+            return spline.Q.invert_segments(x1, x2, x3, xs)
+
+        @staticmethod
+        def invert_segments(
+            x1: np.ndarray, 
+            x2: np.ndarray, 
+            x3: np.ndarray, 
+            xs: np.ndarray,
+        ) -> np.ndarray:
+            """
+            same as `invert_segment`, but knots and handles are given for every value
+            (all arguments broadcast). for every value, the root that falls into [0, 1] is taken.
+            roots are `q/a` and `c/q`, `q = -(b + sign(b)*sqrt(b**2 - 4ac))/2`:
+            no cancellation, and `a == 0` (a straight segment) needs no special case
+            """
             a = x1 - 2 * x2 + x3
             b = 2 * (x2 - x1)
             c = x1 - xs
-            if a == 0:
-                return solve.poly1(b, c)
-            t1, t2 = solve.poly2(a, b, c)
-            return t1 if np.all((0 <= t1) & (t1 < 1)) else t2
+            q = -0.5 * (b + np.copysign(np.sqrt(np.maximum(b * b - 4 * a * c, 0)), b))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t1, t2 = q / a, c / q
+            return np.where((0 <= t1) & (t1 <= 1), t1, t2)
         
-        def sample_at(self, t: np.ndarray, *, no_concatenation = False, strict=False):
+        def sample_at(self, t: np.ndarray, *, no_concatenation = False, strict=False, dtype=None):
             """
             no_concatenation: return segments separately 
             (for debugging, plotting)
-            strict: raise error when number of segments does not match. 
-            if `strict` is False, trim `t` to the appropriate length
+            strict: raise error when `t` implies more segments than the spline has. 
+            if `strict` is False, trim `t` to the appropriate length.
+            points are grouped by segment (keeping their order within a segment),
+            use `evaluate` to keep the order of `t`
             """
             assert np.all(t >=0) and t.ndim == 1
             n_segm = int(np.max(t)) + 1
-            if n_segm <= self.n_segm():
+            if n_segm > self.n_segm():
                 if strict:
                     raise ValueError(f"t implies {n_segm} segments," 
                     f"spline has only {self.n_segm()}")
                 else:
-                    n_segm = self.n_segm()
-                    t = t[t < n_segm]
-            multi_lerp = spline.multi_lerp
-            segments = []
-            for b, e in itr.zip_w_next(range(n_segm + 1)):
-                t_segm = t[(b <= t) & (t < e)] - b
-                if len(t_segm) == 0:
-                    continue
-                t_segm = t_segm[..., np.newaxis]
-                k1 = self.knots[b]
-                h = self.handles[b]
-                k2 = self.knots[e]
-                segm = multi_lerp([k1, h, k2], t_segm)
-                segments.append(segm)
+                    t = t[t < self.n_segm()]
+            i = np.floor(t).astype(np.intp)
+            if not is_monotonic(i, strict=False):
+                order = np.argsort(i, kind="stable")
+                t, i = t[order], i[order]
+            pts = self._at(i, t - i, dtype=dtype)
             if no_concatenation:
-                return segments
-            return np.concatenate(segments, axis=0)     
+                return [p for p in np.split(pts, np.cumsum(np.bincount(i))[:-1]) if len(p)]
+            return pts
+
+        def evaluate(self, t: np.ndarray, *, out: np.ndarray = None, dtype=None) -> np.ndarray:
+            """
+            points at `t` (in any order) at once: segment `floor(t)` 
+            (`t == n_segm()` is the end of the last one) at `t - floor(t)`.
+            `dtype=np.float32` computes in single precision.
+            returns (n, d) shaped array, `out` if it is given
+            """
+            i = np.clip(np.floor(t), 0, self.n_segm() - 1).astype(np.intp)
+            return self._at(i, t - i, out=out, dtype=dtype)
+
+        def _at(self, i: np.ndarray, u: np.ndarray, *, out: np.ndarray = None, dtype=None) -> np.ndarray:
+            """segments `i` at `u`: `(1-u)**2 * k1 + 2u(1-u) * h + u**2 * k2` (Bernstein form)"""
+            dtype = np.result_type(self.handles, u, 1.0) if dtype is None else dtype
+            u = np.asarray(u, dtype=dtype)[:, np.newaxis]
+            v = 1 - u
+            knots = self.knots.astype(dtype, copy=False)
+            if out is None:
+                out = np.empty((len(i), self.n_dim()), dtype=dtype)
+            np.multiply(knots[i], v * v, out=out)
+            out += self.handles.astype(dtype, copy=False)[i] * (2 * u * v)
+            out += knots[i + 1] * (u * u)
+            return out
         
         def n_segm(self) -> int:
             return len(self.handles)
@@ -321,18 +834,190 @@ class spline(metaclass=su.Module):
         def n_dim(self) -> int:
             return self.handles.shape[1]
         
-        def render(self, points_per_segment: int = 10) -> np.ndarray:
+        def render(self, points_per_segment: int = 10, *, out: np.ndarray = None, dtype=None) -> np.ndarray:
             "return (n * points_per_segment, d) shaped array"
-            multi_lerp = spline.multi_lerp
-            t = np.linspace([0, ], [1, ], points_per_segment)
-            segments = [multi_lerp([k1, h, k2], t) for (k1, k2), h in self]
-            return np.concatenate(segments, axis=0)
+            i = np.repeat(np.arange(self.n_segm()), points_per_segment)
+            u = np.tile(np.linspace(0, 1, points_per_segment), self.n_segm())
+            return self._at(i, u, out=out, dtype=dtype)
+
+    class QBatch(_t.NamedTuple):
+        """
+        a stack of m `Q` splines with n handles each, handles are (m, n, d) shaped, 
+        knots are (m, n + 1, d) shaped. every method works on all of them at once:
+        ```
+        qb = spline.QBatch.from_midpoints(traces)  # (m, n, d)
+        t = qb.project_variable(x)  # (m, k), nan where x is out of range
+        pts = qb.sample_at(np.nan_to_num(t))  # (m, k, d)
+        ```
+        """
+        handles: np.ndarray
+        knots: np.ndarray
+
+        @classmethod
+        def from_midpoints(cls, data: np.ndarray):
+            "data shape must be (m, n, d): m curves, n points, d dimensions"
+            assert data.ndim == 3
+            knots = np.concatenate([data[:, :1], (data[:, :-1] + data[:, 1:]) / 2, data[:, -1:]], axis=1)
+            return cls(np.array(data, order="C"), knots)
+
+        def curve(self, j: int) -> "spline.Q":
+            return spline.Q(self.handles[j], self.knots[j])
+
+        def __repr__(self) -> str:
+            return f"<{self.__class__.__name__} at {hex(id(self))}>"
+
+        def n_curves(self) -> int:
+            return self.handles.shape[0]
+
+        def n_segm(self) -> int:
+            return self.handles.shape[1]
+
+        def n_dim(self) -> int:
+            return self.handles.shape[2]
+
+        def project_variable(self, x: np.ndarray, var_no: int = 0) -> np.ndarray:
+            """
+            project x values ((k,) shaped for all curves or (m, k) shaped) onto t-space 
+            of every curve. values out of the curve's handles range give nan 
+            (`Q.project_variable` drops them, which does not fit into an array).
+            knots in this dimension must be monothonic (may be decreasing for some curves)
+            """
+            handles = self.handles[..., var_no]
+            knots = self.knots[..., var_no]
+            sign = np.where(knots[:, -1:] >= knots[:, :1], 1, -1)
+            assert np.all(np.diff(knots, axis=1) * sign > 0), f"self.knots[..., {var_no}] are not monotonic"
+            x = np.asarray(x)
+            n, k = self.n_segm(), x.shape[-1]
+            lo, hi = handles.min(axis=1, keepdims=True), handles.max(axis=1, keepdims=True)
+            t = np.empty((self.n_curves(), k), dtype=np.result_type(x, knots, 1.0))
+            for rows, _ in self._rows(k):
+                xr = x[rows] if x.ndim == 2 else x
+                kf, hf = knots[rows].reshape(-1), handles[rows].reshape(-1)
+                row = np.arange(len(knots[rows]))[:, np.newaxis]
+                kx, xs = (knots[rows] * sign[rows]).reshape(-1), xr * sign[rows]
+                # binary search in every row: the last knot not after x
+                i = np.zeros(xs.shape, dtype=np.intp)
+                step = 1 << (n - 1).bit_length()
+                while step:
+                    cand = np.minimum(i + step, n - 1)
+                    i = np.where(kx[row * (n + 1) + cand] <= xs, cand, i)
+                    step >>= 1
+                k1, k2 = kf[row * (n + 1) + i], kf[row * (n + 1) + i + 1]
+                tr = i + spline.Q.invert_segments(k1, hf[row * n + i], k2, xr)
+                t[rows] = np.where((lo[rows] <= xr) & (xr < hi[rows]), tr, np.nan)
+            return t
+
+        def sample_at(self, t: np.ndarray, *, out: np.ndarray = None, dtype=None) -> np.ndarray:
+            """
+            points at `t` ((k,) shaped for all curves or (m, k) shaped) on every curve, 
+            in the order of `t` (unlike `Q.sample_at`). `0 <= t <= n_segm()`.
+            `dtype=np.float32` computes in single precision.
+            returns (m, k, d) shaped array, `out` if it is given
+            """
+            t = np.asarray(t)
+            assert np.all((0 <= t) & (t <= self.n_segm())), "t is out of the splines' range"
+            dtype = np.result_type(self.handles, t, 1.0) if dtype is None else dtype
+            if out is None:
+                out = np.empty((self.n_curves(), t.shape[-1], self.n_dim()), dtype=dtype)
+            for rows, q in self._rows(t.shape[-1]):
+                tr = t[rows] if t.ndim == 2 else t
+                i = np.minimum(np.floor(tr), self.n_segm() - 1).astype(np.intp)
+                q._at(i, tr - i, out[rows], dtype)
+            return out
+
+        def render(self, points_per_segment: int = 10, *, out: np.ndarray = None, dtype=None) -> np.ndarray:
+            "return (m, n * points_per_segment, d) shaped array"
+            i = np.repeat(np.arange(self.n_segm()), points_per_segment)
+            u = np.linspace(0, 1, points_per_segment)
+            dtype = np.result_type(self.handles, u) if dtype is None else dtype
+            u = np.tile(u, self.n_segm())
+            if out is None:
+                out = np.empty((self.n_curves(), len(i), self.n_dim()), dtype=dtype)
+            for rows, q in self._rows(len(i)):
+                q._at(i, u, out[rows], dtype)
+            return out
+
+        def _rows(self, k: int) -> _t.Iterator[_t.Tuple[slice, "spline.QBatch"]]:
+            """chunks of curves with about 2**16 points of k per curve, to keep temporaries in cache"""
+            step = max(2**16 // max(k, 1), 1)
+            for b in range(0, self.n_curves(), step):
+                yield slice(b, b + step), spline.QBatch(self.handles[b:b + step], self.knots[b:b + step])
+
+        def _at(self, i: np.ndarray, u: np.ndarray, out: np.ndarray, dtype) -> np.ndarray:
+            """segments `i` of every curve at `u` into `out`, see `Q._at`"""
+            n, d = self.n_segm(), self.n_dim()
+            u = np.asarray(u, dtype=dtype)[..., np.newaxis]
+            v = 1 - u
+            row = np.arange(self.n_curves())[:, np.newaxis]
+            knots = self.knots.astype(dtype, copy=False).reshape(-1, d)
+            handles = self.handles.astype(dtype, copy=False).reshape(-1, d)
+            np.multiply(knots[row * (n + 1) + i], v * v, out=out)
+            out += handles[row * n + i] * (2 * u * v)
+            out += knots[row * (n + 1) + i + 1] * (u * u)
+            return out
 
 
 class TableFn:
     """
-    UNFINISHED. creates empyrical function that 
-    uses linear interpolation to approximate a curve
+    creates empyrical function that 
+    uses linear interpolation to approximate a curve.
+    same as `np.interp(x, table_x, table_y, left, right)`, but segment lengths and slopes 
+    are computed once, and segments of a uniform grid are found in O(1) (without searching):
+    ```
+    calibrate = TableFn(raw, physical)
+    values = calibrate(measurements)
+    raw_again = calibrate.inverse()(values)
+    ```
     """
-    def __init__(self): ...
-    def __call__(self): ...
+    def __init__(self, x: np.ndarray, y: np.ndarray, *, left: float = None, right: float = None):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        assert x.ndim == 1 and x.shape == y.shape and len(x) >= 2, "x and y must be 1D of the same length > 1"
+        assert is_monotonic(x), "x must be increasing"
+        self.x = x
+        self.y = y
+        self.dy = np.diff(y)
+        self.slope = self.dy / np.diff(x)
+        self.left = y[0] if left is None else left
+        self.right = y[-1] if right is None else right
+        step = (x[-1] - x[0]) / (len(x) - 1)
+        uniform = np.allclose(np.diff(x), step, rtol=1e-9, atol=0)
+        self.step = step if uniform else None
+
+    def __call__(self, x: np.ndarray, *, out: np.ndarray = None) -> np.ndarray:
+        x = np.asarray(x, dtype=float)
+        out = np.empty(x.shape) if out is None else out
+        last = len(self.x) - 2  # last segment
+        if self.step is not None:
+            u = (x - self.x[0]) / self.step
+            i = np.fmin(np.fmax(np.floor(u), 0), last).astype(np.intp)  # nan goes to 0
+            u -= i
+            np.multiply(self.dy[i], u, out=out)
+        else:
+            i = np.clip(np.searchsorted(self.x, x, side="right") - 1, 0, last)
+            np.multiply(self.slope[i], x - self.x[i], out=out)
+        out += self.y[i]
+        np.copyto(out, self.left, where=x < self.x[0])
+        np.copyto(out, self.right, where=x > self.x[-1])
+        return out if x.ndim else out[()]
+
+    def inverse(self) -> "TableFn":
+        """function with x and y swapped, y must be monotonic"""
+        if is_monotonic(self.y):
+            return TableFn(self.y, self.x)
+        assert is_monotonic(self.y, increasing=False), "y must be monotonic"
+        return TableFn(self.y[::-1], self.x[::-1])
+
+    def __repr__(self) -> str:
+        grid = "uniform" if self.step is not None else "non-uniform"
+        return f"<{self.__class__.__name__} of {len(self.x)} {grid} points at {hex(id(self))}>"
+
+
+def __test_table_fn():
+    x = np.array([0., 1., 2., 4.])
+    y = np.array([1., 3., 2., 0.])
+    xs = np.linspace(-1, 5, 25)
+    for f in TableFn(x, y), TableFn(x[:3], y[:3]):
+        assert np.allclose(f(xs), np.interp(xs, f.x, f.y))
+    f = TableFn(x, -np.exp(x), left=np.nan)
+    inside = xs[(0 <= xs) & (xs <= 4)]
+    assert np.isnan(f(-1)) and np.allclose(f.inverse()(f(inside)), inside)